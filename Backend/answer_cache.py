@@ -0,0 +1,101 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+# ingest_website.py touches this file inside the chroma directory every time
+# it rebuilds the collection; cached answers older than the file are stale
+INDEX_VERSION_FILE = "index_version"
+
+
+def index_version_path(chroma_path):
+    return os.path.join(chroma_path, INDEX_VERSION_FILE)
+
+
+def mark_index_rebuilt(chroma_path):
+    os.makedirs(chroma_path, exist_ok=True)
+    with open(index_version_path(chroma_path), "w") as f:
+        f.write(str(time.time()))
+
+
+def read_index_version(chroma_path):
+    try:
+        return os.stat(index_version_path(chroma_path)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class SemanticAnswerCache:
+    """LRU cache of finished answers, looked up by query embedding.
+
+    A lookup hits when the cosine similarity between the new question and a
+    cached one reaches `threshold` and the entry is younger than `ttl`
+    seconds. The whole cache is dropped when the index version changes.
+    """
+
+    def __init__(self, chroma_path, threshold=0.95, ttl=3600, max_size=512):
+        self.chroma_path = chroma_path
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.next_key = 0
+        self.index_version = read_index_version(chroma_path)
+        self.lock = threading.Lock()
+        # stacked, normalised vectors of all entries; rebuilt lazily
+        self.matrix = None
+        self.matrix_keys = []
+
+    @staticmethod
+    def normalise(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def check_index_version(self):
+        version = read_index_version(self.chroma_path)
+        if version != self.index_version:
+            self.entries.clear()
+            self.matrix = None
+            self.index_version = version
+
+    def expire(self, now):
+        expired = [key for key, (_, _, created) in self.entries.items() if now - created > self.ttl]
+        for key in expired:
+            del self.entries[key]
+        if expired:
+            self.matrix = None
+
+    def get(self, query_vector):
+        with self.lock:
+            self.check_index_version()
+            self.expire(time.monotonic())
+            if not self.entries:
+                return None
+            if self.matrix is None:
+                self.matrix_keys = list(self.entries)
+                self.matrix = np.stack([self.entries[key][0] for key in self.matrix_keys])
+            scores = self.matrix @ self.normalise(query_vector)
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            key = self.matrix_keys[best]
+            self.entries.move_to_end(key)
+            return self.entries[key][1]
+
+    def put(self, query_vector, answer):
+        with self.lock:
+            self.check_index_version()
+            self.entries[self.next_key] = (self.normalise(query_vector), answer, time.monotonic())
+            self.next_key += 1
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            self.matrix = None
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.matrix = None
@@ -1,65 +1,139 @@
-from langchain_openai import ChatOpenAI
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_chroma import Chroma
+import time
+
+# taken before anything else is imported, for the startup profile
+import_started = time.perf_counter()
+
+from langchain_core.documents import Document
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 
 # import the .env file
 from dotenv import load_dotenv
 
 
+# before the local modules, some of which read their settings at import
 load_dotenv()
+
+from answer_cache import SemanticAnswerCache
+from embeddings_cache import CachedEmbeddings, MemoryEmbeddingStore
+from embedding_backends import embedding_backend, embedding_cache_name, load_embeddings
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from context_builder import build_context, count_tokens, format_history, token_encoding, truncate_tokens
+from single_flight import SingleFlight, normalize_question
+from startup import StartupProfile
+
 import os
+import json
+import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+startup = StartupProfile(started=import_started)
+startup.record("import chatbot", time.perf_counter() - import_started)
 
 
 # configuration
 DATA_PATH = r"data"
 CHROMA_PATH = r"chroma_db"
 
+# the LLM client, the embedding model and the vector store are created by
+# load(), which the app's lifespan runs in the background; importing this
+# module stays cheap and uvicorn starts answering /ready right away
+llm = None
+embeddings_model = None
+vector_store = None
 
+# embedded once at startup, so the first real question does not pay for the
+# model's lazy initialization
+WARMUP_QUESTION = os.getenv("WARMUP_QUESTION", "When does the semester start?")
 
-# initiate the model for OpenRouter DeepSeek V3 0324
-llm = ChatOpenAI(
-    temperature=0.5,
-    model="deepseek/deepseek-chat-v3-0324",  # OpenRouter's DeepSeek V3 0324 model name
-    openai_api_key=os.getenv("OPENAI_API_KEY"),
-    openai_api_base=os.getenv("OPENAI_API_BASE"),
-)
+# number of chunks that reach the prompt per question; they are the best of
+# num_candidates dense and num_candidates BM25 hits, fused by rank
+num_results = int(os.getenv("NUM_RESULTS", "4"))
+num_candidates = int(os.getenv("NUM_CANDIDATES", "10"))
 
-# set up the embedding function for retrieval
-embeddings_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-# connect to the chromadb with embedding_function
-vector_store = Chroma(
-    collection_name="example_collection",
-    embedding_function=embeddings_model,
-    persist_directory=CHROMA_PATH, 
-)
+# BM25 index that ingest_website.py builds next to the collection; it finds
+# exact terms like course codes that the embedding model misses. A search
+# that takes longer than LEXICAL_BUDGET seconds is left out of the answer.
+lexical_index = LexicalIndex(CHROMA_PATH)
+LEXICAL_BUDGET = float(os.getenv("LEXICAL_BUDGET", "0.05"))
+lexical_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="lexical")
 
-# Set up the vectorstore to be the retriever
-num_results = 5
-retriever = vector_store.as_retriever(search_kwargs={'k': num_results})
+# token budgets of the prompt sections, so the prompt stays the same size
+# however long the conversation gets
+CONTEXT_TOKENS = int(os.getenv("CONTEXT_TOKENS", "1000"))
+HISTORY_TOKENS = int(os.getenv("HISTORY_TOKENS", "400"))
+HISTORY_MESSAGE_TOKENS = int(os.getenv("HISTORY_MESSAGE_TOKENS", "150"))
+QUESTION_TOKENS = int(os.getenv("QUESTION_TOKENS", "300"))
 
-# call this function for every message added to the chatbot
-def stream_response(message, history):
-    #print(f"Input: {message}. History: {history}\n")
+# embedding the question is CPU-bound, so it runs on a small dedicated pool
+# instead of the event loop; the pool size caps how many forward passes
+# compete for the CPU at the same time
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "2"))
+embed_executor = ThreadPoolExecutor(max_workers=EMBED_WORKERS, thread_name_prefix="embed")
 
-    # retrieve the relevant chunks based on the question asked
-    docs = retriever.invoke(message)
 
-    # add all the chunks to 'knowledge'
-    knowledge = ""
+async def embed_query(message):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(embed_executor, embeddings_model.embed_query, message)
 
-    for doc in docs:
-        knowledge += doc.page_content+"\n\n"
 
+# answers to questions asked without history are cached by query embedding;
+# the cache empties itself whenever ingest_website.py rebuilds the index
+answer_cache = SemanticAnswerCache(
+    CHROMA_PATH,
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+    max_size=int(os.getenv("ANSWER_CACHE_SIZE", "512")),
+)
 
-    # make the call to the LLM (including prompt)
-    if message is not None:
 
-        partial_message = ""
+async def lexical_search(message):
+    loop = asyncio.get_running_loop()
+    try:
+        hits = await asyncio.wait_for(
+            loop.run_in_executor(lexical_executor, lexical_index.search, message, num_candidates),
+            timeout=LEXICAL_BUDGET,
+        )
+    except asyncio.TimeoutError:
+        print("Lexical search exceeded its budget, using dense results only")
+        return []
+    except (OSError, ValueError) as e:
+        print(f"Lexical search failed: {e}")
+        return []
+    return [Document(id=id, page_content=text, metadata=metadata or {}) for id, text, metadata in hits]
+
+
+# retrieve the relevant chunks based on the question asked
+async def retrieve(message, query_vector):
+    dense, lexical = await asyncio.gather(
+        vector_store.asimilarity_search_by_vector(query_vector, k=num_candidates),
+        lexical_search(message),
+    )
+
+    # chunks found by both searches are merged by id
+    docs = {}
+    rankings = []
+    for ranking in (dense, lexical):
+        keys = []
+        for doc in ranking:
+            key = doc.id or doc.page_content
+            docs.setdefault(key, doc)
+            keys.append(key)
+        rankings.append(keys)
+    return [docs[key] for key in reciprocal_rank_fusion(rankings)[:num_results]]
 
-        rag_prompt = f"""
+
+def build_prompt(message, history, docs):
+    # neighbouring chunks are merged and the best ones added up to the budget
+    knowledge = build_context(docs, CONTEXT_TOKENS)
+    # only the most recent turns that fit are kept
+    history = format_history(history, HISTORY_TOKENS, HISTORY_MESSAGE_TOKENS)
+    message = truncate_tokens(message, QUESTION_TOKENS)
+
+    return f"""
         You are an assistent which answers questions based on knowledge which is provided to you.
         While answering, you don't use your internal knowledge, 
         but solely the information in the "The knowledge" section.
@@ -73,16 +147,173 @@ def stream_response(message, history):
 
         """
 
+
+# runs retrieval and the LLM call for one question
+# yields the answer delta by delta as the LLM produces it
+async def generate_response(message, history):
+    #print(f"Input: {message}. History: {history}\n")
+
+    query_vector = await embed_query(message)
+
+    # repeat questions are answered from the cache; the answer depends on the
+    # history as well, so only questions without one are cached
+    cacheable = not history
+    if cacheable:
+        cached = answer_cache.get(query_vector)
+        if cached is not None:
+            yield cached
+            return
+
+    docs = await retrieve(message, query_vector)
+
+    # make the call to the LLM (including prompt)
+    if message is not None:
+
+        rag_prompt = build_prompt(message, history, docs)
+
         print(rag_prompt)
 
-        # stream the response to the Gradio App
-        for response in llm.stream(rag_prompt):
-            partial_message += response.content
-            yield partial_message
+        # pass every delta on as soon as it arrives
+        deltas = []
+        async for response in llm.astream(rag_prompt):
+            if response.content:
+                deltas.append(response.content)
+                yield response.content
+
+        if cacheable and deltas:
+            answer_cache.put(query_vector, "".join(deltas))
+
+
+# identical questions without history that arrive while the first one is
+# still being answered share its retrieval and LLM stream;
+# COALESCE_QUESTIONS=0 answers every request on its own
+COALESCE_QUESTIONS = os.getenv("COALESCE_QUESTIONS", "1") != "0"
+in_flight = SingleFlight()
+
+
+# call this function for every message added to the chatbot
+# yields the answer delta by delta as the LLM produces it
+async def stream_response(message, history):
+    if history or not message or not COALESCE_QUESTIONS:
+        async for delta in generate_response(message, history):
+            yield delta
+        return
+
+    shared = in_flight.stream(
+        normalize_question(message), lambda: generate_response(message, history)
+    )
+    async for delta in shared:
+        yield delta
+
+
+def load():
+    """Create the models and the vector store, then warm them up.
+
+    Runs in a worker thread at startup; every step is timed in `startup`.
+    """
+    global llm, embeddings_model, vector_store
+
+    with startup.step("import langchain_openai"):
+        from langchain_openai import ChatOpenAI
+    with startup.step("import langchain_chroma"):
+        from langchain_chroma import Chroma
+
+    # initiate the model for OpenRouter DeepSeek V3 0324
+    with startup.step("create llm"):
+        llm = ChatOpenAI(
+            temperature=0.5,
+            model="deepseek/deepseek-chat-v3-0324",  # OpenRouter's DeepSeek V3 0324 model name
+            openai_api_key=os.getenv("OPENAI_API_KEY"),
+            openai_api_base=os.getenv("OPENAI_API_BASE"),
+        )
+
+    # set up the embedding function for retrieval (EMBEDDING_BACKEND selects
+    # PyTorch or ONNX); repeated questions are served from an in-memory cache
+    # instead of running the model again
+    with startup.step(f"load embedding model ({embedding_backend()})"):
+        embeddings_model = CachedEmbeddings(
+            load_embeddings(),
+            MemoryEmbeddingStore(max_size=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))),
+            model_name=embedding_cache_name(),
+        )
+    # connect to the chromadb with embedding_function
+    with startup.step("open vector store"):
+        vector_store = Chroma(
+            collection_name="example_collection",
+            embedding_function=embeddings_model,
+            persist_directory=CHROMA_PATH,
+        )
+
+    # the first forward pass and the first search are much slower than the
+    # following ones; the warm-up goes past the cache so the model really runs
+    with startup.step("warm up embedding model"):
+        query_vector = embeddings_model.model.embed_query(WARMUP_QUESTION)
+    with startup.step("warm up vector store"):
+        vector_store.similarity_search_by_vector(query_vector, k=num_candidates)
+    with startup.step("load lexical index"):
+        lexical_index.current()
+    with startup.step("load tokenizer"):
+        token_encoding()
+        count_tokens(WARMUP_QUESTION)
+
+
+# set by the lifespan while load() runs
+loading = None
+
+
+async def load_in_background():
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, load)
+    except Exception as e:
+        startup.finish(error=e)
+        return
+    startup.finish()
+
+
+async def wait_until_ready():
+    # requests that arrive during startup wait for it instead of failing
+    if not startup.ready.is_set() and loading is not None:
+        await asyncio.shield(loading)
+    if startup.error is not None:
+        raise RuntimeError(f"Chatbot failed to start: {startup.error}")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    global loading
+    loading = asyncio.create_task(load_in_background())
+    yield
+    embed_executor.shutdown(wait=False)
+    lexical_executor.shutdown(wait=False)
+
+
+# format a single Server-Sent Event
+def sse_event(data, event=None):
+    payload = f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    if event:
+        payload = f"event: {event}\n" + payload
+    return payload
+
+
+# wrap the deltas of stream_response into SSE events
+async def sse_stream(message, history):
+    try:
+        async for delta in stream_response(message, history):
+            yield sse_event({"delta": delta})
+    except Exception as e:
+        print(f"Streaming failed: {e}")
+        yield sse_event({"error": str(e)}, event="error")
+        return
+    yield sse_event({}, event="done")
+
+
+def wants_stream(request: Request, data):
+    return bool(data.get("stream")) or "text/event-stream" in request.headers.get("accept", "")
 
 
 # FastAPI app for HTTP API
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Allow CORS for local frontend dev
 app.add_middleware(
@@ -93,13 +324,34 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# readiness probe: 200 once the models and the index are loaded and warm,
+# 503 until then; the body lists how long each startup step took
+@app.get("/ready")
+async def ready_endpoint():
+    status = startup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
 @app.post("/api/chatbot")
 async def chatbot_endpoint(request: Request):
+    try:
+        await wait_until_ready()
+    except RuntimeError as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
+
     data = await request.json()
     message = data.get("message")
     history = data.get("history", [])
-    # stream_response yields partials, but for API we want the final answer
-    response = ""
-    for partial in stream_response(message, history):
-        response = partial
-    return JSONResponse({"response": response})
\ No newline at end of file
+
+    # clients that send {"stream": true} or accept text/event-stream get the
+    # answer token by token as Server-Sent Events
+    if wants_stream(request, data):
+        return StreamingResponse(
+            sse_stream(message, history),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    # everyone else gets the complete answer as a single JSON document
+    response = "".join([delta async for delta in stream_response(message, history)])
+    return JSONResponse({"response": response})
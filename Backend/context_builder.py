@@ -0,0 +1,148 @@
+import functools
+
+
+# retrieved chunks overlap by up to chunk_overlap characters; shorter
+# matches between two chunks are treated as coincidence
+MIN_OVERLAP = 20
+# a passage is only cut to fit the budget if at least this much of it fits
+MIN_PASSAGE_TOKENS = 40
+
+
+@functools.lru_cache(maxsize=1)
+def token_encoding():
+    # tiktoken comes with langchain-openai; without it (or without its
+    # downloaded vocabulary) tokens are estimated from the length
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text):
+    encoding = token_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, max_tokens):
+    """Cut text down to about max_tokens, at a word boundary."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = token_encoding()
+    if encoding is None:
+        text = text[: max_tokens * 4]
+    else:
+        text = encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    cut = text.rfind(" ")
+    if cut > len(text) // 2:
+        text = text[:cut]
+    return text.rstrip() + " …"
+
+
+def chunk_position(doc):
+    """(page, index) from the "<page hash>-<index>" ids that ingest assigns."""
+    page, _, index = (doc.id or "").rpartition("-")
+    if page and index.isdigit():
+        return page, int(index)
+    return None
+
+
+def overlap_length(first, second):
+    """Length of the longest suffix of `first` that starts `second`."""
+    for size in range(min(len(first), len(second)), MIN_OVERLAP - 1, -1):
+        if first.endswith(second[:size]):
+            return size
+    return 0
+
+
+def merge_passages(docs):
+    """Join neighbouring chunks of the same page into passages, best ranked first.
+
+    Adjacent chunks repeat up to chunk_overlap characters of each other;
+    the repeated part is kept only once. A passage ranks as well as its
+    best chunk.
+    """
+    pages = {}
+    passages = []
+    seen = set()
+    for rank, doc in enumerate(docs):
+        if doc.page_content in seen:
+            continue
+        seen.add(doc.page_content)
+        position = chunk_position(doc)
+        if position is None:
+            passages.append((rank, doc.page_content))
+            continue
+        pages.setdefault(position[0], []).append((position[1], rank, doc.page_content))
+
+    for chunks in pages.values():
+        chunks.sort()
+        last_index, best_rank, text = chunks[0]
+        for index, rank, content in chunks[1:]:
+            overlap = overlap_length(text, content)
+            if overlap or index == last_index + 1:
+                separator = "" if overlap else " "
+                text = text + separator + content[overlap:]
+                best_rank = min(best_rank, rank)
+            else:
+                passages.append((best_rank, text))
+                best_rank, text = rank, content
+            last_index = index
+        passages.append((best_rank, text))
+
+    passages.sort(key=lambda passage: passage[0])
+    return [text for _, text in passages]
+
+
+def build_context(docs, max_tokens):
+    """The knowledge section: merged passages in rank order, within max_tokens."""
+    parts = []
+    remaining = max_tokens
+    for passage in merge_passages(docs):
+        tokens = count_tokens(passage)
+        if tokens > remaining:
+            if remaining >= MIN_PASSAGE_TOKENS:
+                parts.append(truncate_tokens(passage, remaining))
+            break
+        parts.append(passage)
+        remaining -= tokens
+    return "".join(part + "\n\n" for part in parts)
+
+
+def history_messages(history):
+    # the frontend sends [user, bot] pairs; OpenAI-style role dicts work too
+    for entry in history or []:
+        if isinstance(entry, dict):
+            role = "User" if entry.get("role") == "user" else "Assistant"
+            if entry.get("content"):
+                yield role, str(entry["content"])
+        elif isinstance(entry, (list, tuple)):
+            for role, text in zip(("User", "Assistant"), entry):
+                if text:
+                    yield role, str(text)
+        elif entry:
+            yield "User", str(entry)
+
+
+def format_history(history, max_tokens, max_message_tokens):
+    """The most recent messages that fit into max_tokens, oldest first.
+
+    Every message is cut to max_message_tokens first, so one long answer
+    cannot push out the rest of the conversation.
+    """
+    lines = []
+    remaining = max_tokens
+    messages = list(history_messages(history))
+    for role, text in reversed(messages):
+        line = f"{role}: {truncate_tokens(text, max_message_tokens)}"
+        tokens = count_tokens(line)
+        if tokens > remaining:
+            break
+        lines.append(line)
+        remaining -= tokens
+    if len(lines) < len(messages):
+        lines.append("(earlier messages omitted)")
+    return "\n".join(reversed(lines))
@@ -0,0 +1,124 @@
+import os
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from embeddings_cache import EMBEDDING_MODEL
+
+
+# the ONNX vectors are not identical to the PyTorch ones; they count as
+# compatible with a collection built by the PyTorch backend if every text's
+# two vectors have at least ONNX_TOLERANCE cosine similarity and ONNX queries
+# find at least ONNX_MIN_OVERLAP of the chunks the PyTorch queries find
+# (benchmarks/embeddings.py checks both)
+ONNX_TOLERANCE = 0.98
+ONNX_MIN_OVERLAP = 0.9
+
+# all-MiniLM-L6-v2 was trained on at most 256 word pieces per text;
+# sentence-transformers cuts longer texts there as well
+MAX_SEQUENCE_LENGTH = 256
+
+
+def embedding_backend():
+    # "torch" runs the sentence-transformers model through PyTorch; "onnx"
+    # runs an int8-quantized ONNX export of the same model through
+    # onnxruntime, which needs neither PyTorch nor a GPU. Like the other
+    # settings it is read on use, so a .env loaded after the import applies
+    return os.getenv("EMBEDDING_BACKEND", "torch")
+
+
+def onnx_model_file():
+    # a file of the model repository on the Hugging Face hub or a local
+    # path; the hub has exports for AVX2 (this one), AVX-512 and ARM64 CPUs
+    return os.getenv("ONNX_MODEL_FILE", "onnx/model_quint8_avx2.onnx")
+
+
+class OnnxEmbeddings(Embeddings):
+    """Sentence-transformers model run as an ONNX export through onnxruntime.
+
+    Mean pooling and normalization happen here, the same way the
+    sentence-transformers pipeline of all-MiniLM-L6-v2 does them.
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL, model_file=None, batch_size=32, threads=None):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        if model_file is None:
+            model_file = onnx_model_file()
+        if threads is None:
+            # 0 lets onnxruntime use every core
+            threads = int(os.getenv("ONNX_THREADS", "0"))
+
+        if os.path.exists(model_file):
+            # a local export, with tokenizer.json next to it or one level up
+            # as in the hub layout
+            model_path = model_file
+            model_dir = os.path.dirname(os.path.abspath(model_file))
+            tokenizer_path = os.path.join(model_dir, "tokenizer.json")
+            if not os.path.exists(tokenizer_path):
+                tokenizer_path = os.path.join(os.path.dirname(model_dir), "tokenizer.json")
+        else:
+            from huggingface_hub import hf_hub_download
+
+            model_path = hf_hub_download(model_name, model_file)
+            tokenizer_path = hf_hub_download(model_name, "tokenizer.json")
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=MAX_SEQUENCE_LENGTH)
+        self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id("[PAD]") or 0, pad_token="[PAD]")
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            model_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.batch_size = batch_size
+
+    def embed_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        token_vectors = self.session.run(
+            None, {name: value for name, value in inputs.items() if name in self.input_names}
+        )[0]
+
+        # average the token vectors of every text, without its padding
+        mask = inputs["attention_mask"][:, :, None].astype(np.float32)
+        vectors = (token_vectors * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+    def embed_documents(self, texts):
+        # same preprocessing as HuggingFaceEmbeddings, so the vectors match
+        texts = [text.replace("\n", " ") for text in texts]
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self.embed_batch(texts[start : start + self.batch_size]).tolist())
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def embedding_cache_name(backend=None):
+    # vectors of the two backends differ, so they are cached apart
+    if (backend or embedding_backend()) == "onnx":
+        return f"{EMBEDDING_MODEL}:{onnx_model_file()}"
+    return EMBEDDING_MODEL
+
+
+def load_embeddings(backend=None, batch_size=32):
+    """The embedding model of the given backend, by default EMBEDDING_BACKEND."""
+    backend = backend or embedding_backend()
+    if backend == "onnx":
+        return OnnxEmbeddings(batch_size=batch_size)
+    if backend == "torch":
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+
+        return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL, encode_kwargs={"batch_size": batch_size})
+    raise ValueError(f"Unknown EMBEDDING_BACKEND {backend!r}, expected 'torch' or 'onnx'")
@@ -0,0 +1,209 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+def content_hash(model_name, text):
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+class MemoryEmbeddingStore:
+    """Bounded in-memory LRU store, used by the chatbot server."""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.vectors = OrderedDict()
+        self.lock = threading.Lock()
+
+    def mget(self, keys):
+        with self.lock:
+            found = []
+            for key in keys:
+                vector = self.vectors.get(key)
+                if vector is not None:
+                    self.vectors.move_to_end(key)
+                found.append(vector)
+            return found
+
+    def mset(self, items):
+        with self.lock:
+            for key, vector in items:
+                self.vectors[key] = vector
+                self.vectors.move_to_end(key)
+            while len(self.vectors) > self.max_size:
+                self.vectors.popitem(last=False)
+
+
+class DiskEmbeddingStore:
+    """Append-only on-disk store, used by ingest_website.py.
+
+    Vectors live in one float32 file that is memory-mapped for reads.
+    keys.log maps every content hash to its row in that file, one
+    "<hash> <row>" line per vector; the lines are appended only after the
+    vectors are on disk, so a row counts once its line is complete.
+    compact() rewrites both files with only the vectors still in use.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self.keys_path = os.path.join(path, "keys.log")
+        self.meta_path = os.path.join(path, "meta.json")
+        os.makedirs(path, exist_ok=True)
+
+        self.index = {}
+        self.dim = None
+        self.rows = 0
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.dim = json.load(f)["dim"]
+        self.finish_compaction()
+        self.load_keys()
+        self.vectors = None
+        self.lock = threading.Lock()
+
+    def finish_compaction(self):
+        # a compaction commits by renaming its key file into place; if that
+        # happened, the new files replace the old ones, otherwise they are
+        # leftovers of an interrupted compaction
+        compact_keys = self.keys_path + ".compact"
+        compact_vectors = self.vectors_path + ".compact"
+        if os.path.exists(compact_keys):
+            if os.path.exists(compact_vectors):
+                os.replace(compact_vectors, self.vectors_path)
+            os.replace(compact_keys, self.keys_path)
+            return
+        for leftover in (compact_vectors, compact_keys + ".tmp"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    def load_keys(self):
+        if not os.path.exists(self.keys_path):
+            return
+        with open(self.keys_path, "rb+") as f:
+            data = f.read()
+            # a line cut off by a crash is dropped along with its row
+            complete = data.rfind(b"\n") + 1
+            if complete < len(data):
+                f.truncate(complete)
+        for line in data[:complete].decode("ascii").splitlines():
+            key, row = line.split()
+            self.index[key] = int(row)
+            self.rows = max(self.rows, int(row) + 1)
+
+    def save_meta(self, dim):
+        self.dim = dim
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"dim": dim}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def open_vectors(self):
+        if self.vectors is None and self.rows:
+            self.vectors = np.memmap(
+                self.vectors_path, dtype=np.float32, mode="r", shape=(self.rows, self.dim)
+            )
+        return self.vectors
+
+    def mget(self, keys):
+        with self.lock:
+            vectors = self.open_vectors()
+            found = []
+            for key in keys:
+                row = self.index.get(key)
+                found.append(None if row is None else vectors[row].tolist())
+            return found
+
+    def mset(self, items):
+        with self.lock:
+            new_items = {}
+            for key, vector in items:
+                if key not in self.index:
+                    new_items.setdefault(key, vector)
+            if not new_items:
+                return
+            block = np.asarray(list(new_items.values()), dtype=np.float32)
+            if self.dim is None:
+                self.save_meta(block.shape[1])
+
+            # bytes past the last committed row are a torn or uncommitted
+            # append; cutting them off keeps the new rows on row boundaries
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(self.rows * self.dim * 4)
+                f.write(block.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.keys_path, "a") as f:
+                f.writelines(f"{key} {row}\n" for row, key in enumerate(new_items, start=self.rows))
+            for row, key in enumerate(new_items, start=self.rows):
+                self.index[key] = row
+            self.rows += len(new_items)
+            self.vectors = None
+
+    def compact(self, keep):
+        """Drop every vector whose key is not in `keep`; returns how many were dropped."""
+        with self.lock:
+            kept = [key for key in self.index if key in keep]
+            dropped = len(self.index) - len(kept)
+            if not dropped:
+                return 0
+            vectors = self.open_vectors()
+            compact_vectors = self.vectors_path + ".compact"
+            compact_keys = self.keys_path + ".compact"
+            with open(compact_vectors, "wb") as f:
+                for start in range(0, len(kept), 4096):
+                    rows = [self.index[key] for key in kept[start : start + 4096]]
+                    f.write(np.ascontiguousarray(vectors[rows]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(compact_keys + ".tmp", "w") as f:
+                f.writelines(f"{key} {row}\n" for row, key in enumerate(kept))
+                f.flush()
+                os.fsync(f.fileno())
+            # the old vectors file must not stay mapped once it is replaced
+            del vectors
+            self.vectors = None
+            os.replace(compact_keys + ".tmp", compact_keys)
+            self.finish_compaction()
+
+            self.index = {key: row for row, key in enumerate(kept)}
+            self.rows = len(kept)
+            return dropped
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only runs the model for texts it has not seen."""
+
+    def __init__(self, model, store, model_name=EMBEDDING_MODEL):
+        self.model = model
+        self.store = store
+        self.model_name = model_name
+
+    def embed_documents(self, texts):
+        keys = [content_hash(self.model_name, text) for text in texts]
+        vectors = self.store.mget(keys)
+
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = self.model.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+            self.store.mset([(keys[i], vectors[i]) for i in missing])
+        return vectors
+
+    def embed_query(self, text):
+        # some models embed queries differently from documents
+        key = content_hash(self.model_name + ":query", text)
+        vector = self.store.mget([key])[0]
+        if vector is None:
+            vector = self.model.embed_query(text)
+            self.store.mset([(key, vector)])
+        return vector
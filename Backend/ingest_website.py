@@ -1,12 +1,26 @@
 import requests
 from bs4 import BeautifulSoup
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
-from uuid import uuid4
+from langchain_core.embeddings import Embeddings
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+import argparse
+import hashlib
+import json
+import os
+import queue
+import threading
 import time
 
+from answer_cache import mark_index_rebuilt
+from embeddings_cache import EMBEDDING_MODEL, CachedEmbeddings, DiskEmbeddingStore, content_hash
+from embedding_backends import embedding_backend, embedding_cache_name, load_embeddings
+from lexical_index import BM25Index, lexical_index_path
+
 
 
 # Configuration
@@ -47,11 +61,34 @@ FAQ_AND_DIRECT_LINKS = [
     "https://lea.hochschule-bonn-rhein-sieg.de/ilias.php?cmdClass=ilpasswordassistancegui&cmdNode=11a%3Auk&baseClass=ilStartUpGUI&lang=de",
 ]
 CHROMA_PATH = "chroma_db"
+# chunk embeddings are kept here between runs, keyed by a hash of their text
+EMBEDDING_CACHE_PATH = "embedding_cache"
+# validators, content hash, links and chunk ids of every page from the last run
+INGEST_STATE_PATH = "ingest_state.json"
 
 # Set crawl limits
 MAIN_SITE_MAX_PAGES = 300
 FAQ_LINKS_MAX_PAGES = 1  # Only fetch each direct link once
 
+# Politeness: requests run in parallel, but never more than
+# PER_HOST_CONCURRENCY at once against the same host, and request starts
+# against one host are spaced to stay below PER_HOST_REQUESTS_PER_SECOND
+CRAWL_WORKERS = 16
+PER_HOST_CONCURRENCY = 4
+PER_HOST_REQUESTS_PER_SECOND = 4.0
+REQUEST_TIMEOUT = 10
+USER_AGENT = "HBRS-GO-ingest/1.0 (+https://www.h-brs.de)"
+
+# Embedding stage: chunks are embedded EMBED_BATCH_SIZE at a time, on
+# EMBED_PROCESSES worker processes when set above 1; every embedded batch is
+# handed to the Chroma writer thread while the next one is being embedded
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+EMBED_PROCESSES = int(os.getenv("EMBED_PROCESSES", "1"))
+WRITE_QUEUE_SIZE = 4
+# the crawl state is saved after this many finished pages, so an interrupted
+# ingest resumes with the pages that were not finished yet
+CHECKPOINT_EVERY = 20
+
 
 def is_internal_link(href):
     if not href:
@@ -65,76 +102,500 @@ def full_url(base, href):
         return f"https://www.h-brs.de{href}"
     return base.rstrip("/") + "/" + href
 
-def crawl_site(start_urls, max_pages=100):
-    visited = set()
-    to_visit = list(start_urls)
-    documents = []
-    while to_visit and len(visited) < max_pages:
-        url = to_visit.pop(0)
-        if url in visited:
+# query parameters that only track where a click came from
+TRACKING_PARAMS = {"fbclid", "gclid", "msclkid", "mc_cid", "mc_eid", "_ga", "_gl"}
+
+def canonical_url(url):
+    # key used to recognise the same page behind different spellings of its URL
+    parts = urlparse(url)
+    scheme = parts.scheme.lower()
+    host = parts.netloc.lower()
+    if (scheme, host.rsplit(":", 1)[-1]) in (("http", "80"), ("https", "443")):
+        host = host.rsplit(":", 1)[0]
+    path = parts.path.rstrip("/") or "/"
+    query = urlencode(sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.startswith("utm_") and key not in TRACKING_PARAMS
+    ))
+    return urlunparse((scheme, host, path, parts.params, query, ""))
+
+class HostLimiter:
+    """Per-host concurrency and rate limit shared by all crawler threads."""
+
+    def __init__(self, max_concurrent, requests_per_second):
+        self.max_concurrent = max_concurrent
+        self.min_interval = 1.0 / requests_per_second
+        self.semaphores = {}
+        self.next_start = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, host):
+        with self.lock:
+            semaphore = self.semaphores.setdefault(host, threading.BoundedSemaphore(self.max_concurrent))
+        semaphore.acquire()
+        # reserve the next free start slot for this host, then wait for it
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start.get(host, now))
+            self.next_start[host] = start + self.min_interval
+        if start > now:
+            time.sleep(start - now)
+
+    def release(self, host):
+        self.semaphores[host].release()
+
+
+def make_session(pool_size):
+    # one session for the whole crawl, so keep-alive connections are reused
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+
+def fetch_page(session, limiter, url, previous=None):
+    # ask the server to skip the body if the page did not change since the last run
+    headers = {}
+    if previous:
+        if previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
+
+    host = urlparse(url).netloc
+    limiter.acquire(host)
+    try:
+        resp = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+    finally:
+        limiter.release(host)
+
+    page = {
+        "url": url,
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+        "document": None,
+    }
+    if resp.status_code == 304 and previous:
+        page["etag"] = page["etag"] or previous.get("etag")
+        page["last_modified"] = page["last_modified"] or previous.get("last_modified")
+        page["content_hash"] = previous["content_hash"]
+        page["links"] = previous["links"]
+        return page
+    resp.raise_for_status()
+
+    soup = BeautifulSoup(resp.text, "html.parser")
+    texts = soup.stripped_strings
+    text = "\n".join(texts)
+    page["content_hash"] = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    page["links"] = [
+        full_url("https://www.h-brs.de", a["href"])
+        for a in soup.find_all("a", href=True)
+        if is_internal_link(a["href"])
+    ]
+    # servers without validators still send the page; only a different text
+    # means the page has to be split and embedded again
+    if not previous or previous["content_hash"] != page["content_hash"]:
+        page["document"] = Document(page_content=text, metadata={"source": url})
+    return page
+
+
+def is_gone(error):
+    # 404 and 410 mean the page was removed; anything else may be temporary
+    return (
+        isinstance(error, requests.HTTPError)
+        and error.response is not None
+        and error.response.status_code in (404, 410)
+    )
+
+
+def crawl_site(start_urls, max_pages=100, state=None):
+    # yields every page as soon as it is fetched, so callers can process the
+    # crawl page by page; pages whose text did not change since `state` was
+    # saved have no document, and pages that could not be fetched are
+    # yielded as {"url": ..., "failed": True, "gone": <404 or 410>}
+    state = state or {}
+
+    # FIFO frontier plus the canonical form of every URL ever queued, so
+    # both taking the next URL and checking a link are O(1)
+    to_visit = deque()
+    seen = set()
+    for url in start_urls:
+        key = canonical_url(url)
+        if key not in seen:
+            seen.add(key)
+            to_visit.append(url)
+
+    fetched = 0
+    session = make_session(CRAWL_WORKERS)
+    limiter = HostLimiter(PER_HOST_CONCURRENCY, PER_HOST_REQUESTS_PER_SECOND)
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=CRAWL_WORKERS) as pool:
+        while (to_visit or in_flight) and fetched < max_pages:
+            # keep the pool busy without fetching more pages than allowed
+            while to_visit and fetched + len(in_flight) < max_pages:
+                url = to_visit.popleft()
+                previous = state.get(canonical_url(url))
+                in_flight[pool.submit(fetch_page, session, limiter, url, previous)] = url
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = in_flight.pop(future)
+                try:
+                    page = future.result()
+                except Exception as e:
+                    print(f"Failed to fetch {url}: {e}")
+                    yield {"url": url, "failed": True, "gone": is_gone(e)}
+                    continue
+                fetched += 1
+                # Find new links
+                for abs_url in page["links"]:
+                    key = canonical_url(abs_url)
+                    if key not in seen:
+                        seen.add(key)
+                        to_visit.append(abs_url)
+                yield page
+    session.close()
+
+
+def load_state(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(path, state):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def linked_pages(start_urls, state, gone):
+    """Canonical URLs reachable from start_urls over the links stored in state.
+
+    Links of pages fetched in this run are their current ones; pages past
+    the crawl budget contribute the links from their last fetch, so where
+    the budget happened to cut off the crawl does not matter.
+    """
+    linked = set()
+    to_visit = deque(canonical_url(url) for url in start_urls)
+    while to_visit:
+        key = to_visit.popleft()
+        if key in linked or key in gone:
             continue
+        linked.add(key)
+        entry = state.get(key)
+        if entry:
+            to_visit.extend(canonical_url(link) for link in entry["links"])
+    return linked
+
+
+def chunk_ids(url, count):
+    # deterministic ids, so re-ingesting a page overwrites its chunks
+    url_id = hashlib.sha256(canonical_url(url).encode("utf-8")).hexdigest()[:16]
+    return [f"{url_id}-{i}" for i in range(count)]
+
+
+class Checkpoint:
+    """Crawl state that is saved to disk while the ingest is running.
+
+    A page is committed only once its chunks are in the collection, so an
+    interrupted run picks up every page that was not finished: its stored
+    hash still differs from the live page and it is embedded again.
+    """
+
+    def __init__(self, path, state, every):
+        self.path = path
+        self.state = dict(state)
+        self.every = every
+        self.uncommitted = 0
+        self.lock = threading.Lock()
+
+    def commit(self, key, entry):
+        with self.lock:
+            self.state[key] = entry
+            self.uncommitted += 1
+            if self.uncommitted >= self.every:
+                save_state(self.path, self.state)
+                self.uncommitted = 0
+
+    def remove(self, key):
+        with self.lock:
+            self.state.pop(key, None)
+
+    def save(self):
+        with self.lock:
+            save_state(self.path, self.state)
+            self.uncommitted = 0
+
+
+class MultiProcessEmbeddings(Embeddings):
+    """Runs the sentence-transformers model on a pool of CPU worker processes."""
+
+    def __init__(self, model_name, processes, batch_size):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.pool = self.model.start_multi_process_pool(target_devices=["cpu"] * processes)
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts):
+        # same preprocessing as HuggingFaceEmbeddings, so the vectors match
+        texts = [text.replace("\n", " ") for text in texts]
+        return self.model.encode_multi_process(texts, self.pool, batch_size=self.batch_size).tolist()
+
+    def embed_query(self, text):
+        return self.model.encode(text.replace("\n", " ")).tolist()
+
+    def close(self):
+        self.model.stop_multi_process_pool(self.pool)
+
+
+def load_embeddings_model():
+    # onnxruntime already spreads one batch over all cores, so the process
+    # pool is only used with the PyTorch backend
+    if embedding_backend() == "torch" and EMBED_PROCESSES > 1:
+        return MultiProcessEmbeddings(EMBEDDING_MODEL, EMBED_PROCESSES, EMBED_BATCH_SIZE)
+    return load_embeddings(batch_size=EMBED_BATCH_SIZE)
+
+
+def write_batches(collection, checkpoint, batches, errors):
+    # writer thread: upserts embedded batches until it receives None and
+    # commits every page whose last chunk was in the batch
+    while True:
+        batch = batches.get()
+        if batch is None:
+            return
+        if errors:
+            continue
+        ids, chunks, vectors, finished = batch
         try:
-            resp = requests.get(url, timeout=10)
-            soup = BeautifulSoup(resp.text, "html.parser")
-            texts = soup.stripped_strings
-            text = "\n".join(texts)
-            documents.append(Document(page_content=text, metadata={"source": url}))
-            visited.add(url)
-            # Find new links
-            for a in soup.find_all("a", href=True):
-                href = a["href"]
-                if is_internal_link(href):
-                    abs_url = full_url("https://www.h-brs.de", href)
-                    if abs_url not in visited and abs_url not in to_visit:
-                        to_visit.append(abs_url)
-            time.sleep(0.5)  # Be polite
+            if ids:
+                collection.upsert(
+                    ids=ids,
+                    embeddings=vectors,
+                    documents=[chunk.page_content for chunk in chunks],
+                    metadatas=[chunk.metadata for chunk in chunks],
+                )
+            for key, entry, stale_ids in finished:
+                if stale_ids:
+                    collection.delete(ids=stale_ids)
+                checkpoint.commit(key, entry)
         except Exception as e:
-            print(f"Failed to fetch {url}: {e}")
-    return documents
+            errors.append(e)
+
+
+def embed_and_write(page_chunks, embeddings_model, collection, checkpoint):
+    # pulls (key, entry, stale_ids, ids, chunks) for one page at a time from
+    # the splitter, embeds the chunks EMBED_BATCH_SIZE at a time and streams
+    # the results to the writer thread; returns the number of chunks written
+    batches = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+    errors = []
+    writer = threading.Thread(
+        target=write_batches, args=(collection, checkpoint, batches, errors), daemon=True
+    )
+    writer.start()
+
+    pending_ids = []
+    pending_chunks = []
+    # pages waiting for their last chunk to be written, with the position
+    # of that chunk in the pending list
+    pending_pages = []
+    total = 0
+    embed_seconds = 0.0
+    start = time.perf_counter()
+
+    def flush(size):
+        nonlocal pending_ids, pending_chunks, pending_pages, total, embed_seconds
+        ids, pending_ids = pending_ids[:size], pending_ids[size:]
+        chunks, pending_chunks = pending_chunks[:size], pending_chunks[size:]
+        finished = [page for end, page in pending_pages if end <= size]
+        pending_pages = [(end - size, page) for end, page in pending_pages if end > size]
+
+        vectors = []
+        if chunks:
+            embed_start = time.perf_counter()
+            vectors = embeddings_model.embed_documents([chunk.page_content for chunk in chunks])
+            embed_seconds += time.perf_counter() - embed_start
+        batches.put((ids, chunks, vectors, finished))
+        total += len(chunks)
+
+    try:
+        for key, entry, stale_ids, ids, chunks in page_chunks:
+            if errors:
+                break
+            pending_ids.extend(ids)
+            pending_chunks.extend(chunks)
+            pending_pages.append((len(pending_chunks), (key, entry, stale_ids)))
+            while len(pending_chunks) >= EMBED_BATCH_SIZE:
+                flush(EMBED_BATCH_SIZE)
+        if not errors and pending_pages:
+            flush(len(pending_chunks))
+    finally:
+        batches.put(None)
+        writer.join()
+    if errors:
+        raise errors[0]
+
+    elapsed = time.perf_counter() - start
+    if total:
+        print(
+            f"Embedded and wrote {total} chunks in {elapsed:.1f}s "
+            f"({total / elapsed:.1f} chunks/s overall, {total / max(embed_seconds, 1e-9):.1f} chunks/s embedding)"
+        )
+    return total
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Crawl the H-BRS websites into the chatbot's Chroma collection")
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Ignore the state of the last run and rebuild the collection from scratch.",
+    )
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    # without a state file the chunks already in the collection are unknown,
+    # e.g. those written before pages got deterministic chunk ids; they would
+    # never be replaced or deleted, so the collection is rebuilt instead
+    full = args.full or not os.path.exists(INGEST_STATE_PATH)
+    state = {} if full else load_state(INGEST_STATE_PATH)
+
+    # Split text into chunks
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=300,
+        chunk_overlap=100,
+        length_function=len,
+        is_separator_regex=False,
+    )
+
+    # Embeddings and vector store; unchanged chunks reuse their cached vectors
+    model = load_embeddings_model()
+    embeddings_model = CachedEmbeddings(
+        model, DiskEmbeddingStore(EMBEDDING_CACHE_PATH), model_name=embedding_cache_name()
+    )
+    vector_store = Chroma(
+        collection_name="example_collection",
+        embedding_function=embeddings_model,
+        persist_directory=CHROMA_PATH,
+    )
+    if full:
+        if not args.full and vector_store._collection.count():
+            print(f"No {INGEST_STATE_PATH} found, rebuilding the collection from scratch.")
+        vector_store.reset_collection()
+    # the vectors are computed here, so they are written straight into the
+    # collection behind the langchain wrapper
+    collection = vector_store._collection
+    checkpoint = Checkpoint(INGEST_STATE_PATH, state, every=CHECKPOINT_EVERY)
 
+    # canonical URLs of every page reached in this run, fetched or not, and
+    # of the pages among them that answered 404 or 410
+    reached = set()
+    gone = set()
+    counts = {"pages": 0, "changed": 0, "failed": 0}
 
-# Crawl main site deeply
-print("Crawling main site URLs (deep crawl)...")
-documents = crawl_site(MAIN_SITE_URLS, max_pages=MAIN_SITE_MAX_PAGES)
-print(f"Crawled {len(documents)} pages from main site.")
+    def crawl():
+        # Crawl main site deeply
+        print("Crawling main site URLs (deep crawl)...")
+        yield from crawl_site(MAIN_SITE_URLS, max_pages=MAIN_SITE_MAX_PAGES, state=state)
 
-# Fetch FAQ and direct links (shallow, just the page itself)
-print("Fetching FAQ and direct links...")
-faq_documents = crawl_site(FAQ_AND_DIRECT_LINKS, max_pages=FAQ_LINKS_MAX_PAGES)
-print(f"Fetched {len(faq_documents)} FAQ/direct pages.")
+        # Fetch FAQ and direct links (shallow, just the page itself)
+        print("Fetching FAQ and direct links...")
+        yield from crawl_site(FAQ_AND_DIRECT_LINKS, max_pages=FAQ_LINKS_MAX_PAGES, state=state)
 
-# Combine all documents
-documents.extend(faq_documents)
-print(f"Total documents: {len(documents)}")
+    def split_pages():
+        # turns every changed page into its chunks, one page at a time;
+        # unchanged pages only get their validators refreshed
+        for page in crawl():
+            key = canonical_url(page["url"])
+            if key in reached:
+                continue
+            reached.add(key)
+            if page.get("failed"):
+                counts["failed"] += 1
+                if page["gone"]:
+                    gone.add(key)
+                continue
+            counts["pages"] += 1
 
-# Split text into chunks
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=300,
-    chunk_overlap=100,
-    length_function=len,
-    is_separator_regex=False,
-)
-chunks = text_splitter.split_documents(documents)
+            previous = state.get(key)
+            entry = {
+                "url": page["url"],
+                "etag": page["etag"],
+                "last_modified": page["last_modified"],
+                "content_hash": page["content_hash"],
+                "links": page["links"],
+                "chunk_ids": previous["chunk_ids"] if previous else [],
+            }
+            if page["document"] is None:
+                checkpoint.commit(key, entry)
+                continue
 
-# Embeddings and vector store
-embeddings_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-vector_store = Chroma(
-    collection_name="example_collection",
-    embedding_function=embeddings_model,
-    persist_directory=CHROMA_PATH,
-)
+            counts["changed"] += 1
+            page_chunks = text_splitter.split_documents([page["document"]])
+            entry["chunk_ids"] = chunk_ids(page["url"], len(page_chunks))
+            stale_ids = []
+            if previous:
+                stale_ids = sorted(set(previous["chunk_ids"]) - set(entry["chunk_ids"]))
+            yield key, entry, stale_ids, entry["chunk_ids"], page_chunks
 
+    try:
+        written = embed_and_write(split_pages(), embeddings_model, collection, checkpoint)
+    finally:
+        if isinstance(model, MultiProcessEmbeddings):
+            model.close()
+        checkpoint.save()
+    print(
+        f"Total pages: {counts['pages']}, changed since last run: {counts['changed']}, "
+        f"failed: {counts['failed']}"
+    )
 
-# Chroma batch size workaround
-uuids = [str(uuid4()) for _ in range(len(chunks))]
-BATCH_SIZE = 5000
-for i in range(0, len(chunks), BATCH_SIZE):
-    batch_chunks = chunks[i:i+BATCH_SIZE]
-    batch_uuids = uuids[i:i+BATCH_SIZE]
-    vector_store.add_documents(documents=batch_chunks, ids=batch_uuids)
-print("Ingestion complete.")
+    # pages that answered 404/410 or that no page links to any more are
+    # dropped from the index; pages that failed otherwise or were just past
+    # the crawl budget keep their chunks
+    linked = linked_pages(MAIN_SITE_URLS + FAQ_AND_DIRECT_LINKS, checkpoint.state, gone)
+    removed_ids = []
+    for key, previous in list(checkpoint.state.items()):
+        if key not in linked:
+            removed_ids.extend(previous["chunk_ids"])
+            checkpoint.remove(key)
+    if removed_ids:
+        collection.delete(ids=removed_ids)
+    checkpoint.save()
+    print(f"Upserted {written} chunks, removed {len(removed_ids)} chunks of removed or unlinked pages.")
 
+    # cached vectors of chunk texts that are no longer in the collection are
+    # dropped, so the cache does not grow every time a page changes
+    documents = collection.get(include=["documents"])["documents"]
+    dropped = embeddings_model.store.compact(
+        {content_hash(embeddings_model.model_name, text) for text in documents}
+    )
+    if dropped:
+        print(f"Dropped {dropped} unused vectors from the embedding cache.")
 
+    changed = written or removed_ids or counts["changed"] or full
+    # the BM25 index always covers the whole collection, so it is rebuilt
+    # from the collection instead of being updated page by page
+    if changed or not os.path.exists(lexical_index_path(CHROMA_PATH)):
+        start = time.perf_counter()
+        lexical_index = BM25Index.from_collection(collection)
+        lexical_index.save(lexical_index_path(CHROMA_PATH))
+        print(f"Built the BM25 index of {len(lexical_index)} chunks in {time.perf_counter() - start:.1f}s")
 
+    # tell running chatbot servers that their cached answers and BM25 index are outdated
+    if changed:
+        mark_index_rebuilt(CHROMA_PATH)
+    print("Ingestion complete.")
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import os
+import re
+import json
+import math
+import heapq
+import threading
+from collections import Counter, defaultdict
+
+from answer_cache import read_index_version
+
+
+# ingest_website.py writes the BM25 index of all chunks next to the chroma
+# collection every time it changes the collection
+LEXICAL_INDEX_FILE = "lexical_index.json"
+
+# words, numbers and hyphenated terms such as course codes (MAS-RnD, BI-SE1)
+TOKEN_RE = re.compile(r"\w+(?:[-./]\w+)*")
+SEPARATOR_RE = re.compile(r"[-./]")
+
+
+def lexical_index_path(chroma_path):
+    return os.path.join(chroma_path, LEXICAL_INDEX_FILE)
+
+
+def tokenize(text):
+    tokens = []
+    for match in TOKEN_RE.finditer(text.casefold()):
+        token = match.group()
+        tokens.append(token)
+        # "mas-rnd" is also found by "rnd", "vg-wort" by "wort"
+        if SEPARATOR_RE.search(token):
+            tokens.extend(part for part in SEPARATOR_RE.split(token) if part)
+    return tokens
+
+
+class BM25Index:
+    """Okapi BM25 over the chunks of the collection, with an inverted index."""
+
+    def __init__(self, ids, texts, metadatas, postings=None, k1=1.5, b=0.75):
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.k1 = k1
+        self.b = b
+        if postings is None:
+            postings = defaultdict(list)
+            for doc, text in enumerate(texts):
+                for term, count in Counter(tokenize(text)).items():
+                    postings[term].append([doc, count])
+        self.postings = dict(postings)
+
+        # document lengths only enter the score through this per-document term
+        lengths = [0] * len(texts)
+        for entries in self.postings.values():
+            for doc, count in entries:
+                lengths[doc] += count
+        average = sum(lengths) / len(lengths) if lengths else 0
+        self.length_norms = [
+            k1 * (1 - b + b * length / average) if average else k1 for length in lengths
+        ]
+        total = len(texts)
+        self.idf = {
+            term: math.log(1 + (total - len(entries) + 0.5) / (len(entries) + 0.5))
+            for term, entries in self.postings.items()
+        }
+
+    @classmethod
+    def from_collection(cls, collection):
+        """Build the index from every chunk in a chroma collection."""
+        data = collection.get(include=["documents", "metadatas"])
+        return cls(data["ids"], data["documents"], data["metadatas"])
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            saved = json.load(f)
+        return cls(saved["ids"], saved["texts"], saved["metadatas"], saved["postings"])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "ids": self.ids,
+                    "texts": self.texts,
+                    "metadatas": self.metadatas,
+                    "postings": self.postings,
+                },
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp_path, path)
+
+    def search(self, query, k):
+        """Return the positions of the `k` best matching chunks, best first."""
+        scores = defaultdict(float)
+        k1 = self.k1
+        for term in set(tokenize(query)):
+            entries = self.postings.get(term)
+            if not entries:
+                continue
+            idf = self.idf[term]
+            for doc, count in entries:
+                scores[doc] += idf * count * (k1 + 1) / (count + self.length_norms[doc])
+        return heapq.nlargest(k, scores, key=scores.get)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class LexicalIndex:
+    """The BM25 index of a chroma directory, reloaded whenever ingest rebuilds it."""
+
+    def __init__(self, chroma_path):
+        self.chroma_path = chroma_path
+        self.path = lexical_index_path(chroma_path)
+        self.index = None
+        self.index_version = None
+        self.lock = threading.Lock()
+
+    def current(self):
+        version = read_index_version(self.chroma_path)
+        with self.lock:
+            if self.index is None or version != self.index_version:
+                try:
+                    self.index = BM25Index.load(self.path)
+                except FileNotFoundError:
+                    self.index = None
+                self.index_version = version
+            return self.index
+
+    def search(self, query, k):
+        """Return (id, text, metadata) of the `k` best chunks; empty without an index."""
+        index = self.current()
+        if index is None:
+            return []
+        return [(index.ids[doc], index.texts[doc], index.metadatas[doc]) for doc in index.search(query, k)]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Merge several rankings of keys, best first, into one (Cormack et al., 2009)."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] += 1 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
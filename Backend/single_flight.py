@@ -0,0 +1,76 @@
+import asyncio
+
+
+def normalize_question(message):
+    """Questions that differ only in case, spacing or final punctuation share a key."""
+    return " ".join(message.casefold().split()).rstrip("?!. ")
+
+
+class SharedStream:
+    """Runs one async generator and replays its items to any number of readers.
+
+    Readers that join late first get everything produced so far. An error
+    of the source is raised in every reader.
+    """
+
+    def __init__(self, source):
+        self.items = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Event()
+        self.task = asyncio.create_task(self.run(source))
+
+    async def run(self, source):
+        try:
+            async for item in source:
+                self.items.append(item)
+                self.notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self.notify()
+
+    def notify(self):
+        # wake the current waiters; later waiters wait on a fresh event
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def read(self):
+        position = 0
+        while True:
+            changed = self.changed
+            while position < len(self.items):
+                yield self.items[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
+
+
+class SingleFlight:
+    """Coalesces concurrent streams with the same key into one upstream run.
+
+    A stream is shared only while it is in flight; once it has finished,
+    the next request with the same key starts a new one.
+    """
+
+    def __init__(self):
+        self.in_flight = {}
+
+    def stream(self, key, start):
+        shared = self.in_flight.get(key)
+        if shared is None:
+            shared = SharedStream(start())
+            self.in_flight[key] = shared
+            shared.task.add_done_callback(lambda _: self.finish(key, shared))
+        return shared.read()
+
+    def finish(self, key, shared):
+        if self.in_flight.get(key) is shared:
+            del self.in_flight[key]
+
+    def __len__(self):
+        return len(self.in_flight)
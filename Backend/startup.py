@@ -0,0 +1,51 @@
+import time
+import threading
+from contextlib import contextmanager
+
+
+class StartupProfile:
+    """Wall-clock time of each startup step, and whether startup has finished.
+
+    The steps are printed as they finish and reported by /ready, so a slow
+    cold start shows which import or model load it spent its time in.
+    """
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.steps = {}
+        self.total = None
+        self.error = None
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self.lock:
+            self.steps[name] = seconds
+        print(f"Startup: {name} took {seconds:.2f}s")
+
+    @contextmanager
+    def step(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def finish(self, error=None):
+        self.total = time.perf_counter() - self.started
+        if error is not None:
+            self.error = error
+            print(f"Startup failed after {self.total:.2f}s: {error}")
+            return
+        print(f"Startup: ready after {self.total:.2f}s")
+        self.ready.set()
+
+    def status(self):
+        with self.lock:
+            steps = {name: round(seconds, 3) for name, seconds in self.steps.items()}
+        status = {"ready": self.ready.is_set(), "steps": steps}
+        if self.total is not None:
+            status["total"] = round(self.total, 3)
+        if self.error is not None:
+            status["error"] = str(self.error)
+        return status
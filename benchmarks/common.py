@@ -0,0 +1,91 @@
+"""Helpers shared by the benchmark scripts in this directory."""
+import glob
+import importlib.util
+import json
+import os
+import statistics
+import timeit
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BENCHMARK_DIR, "fixtures")
+MENSA_FIXTURE_DIR = os.path.join(FIXTURE_DIR, "mensa")
+RAG_FIXTURE_DIR = os.path.join(FIXTURE_DIR, "rag")
+MENSA_PATH = os.path.join(BENCHMARK_DIR, "..", "frontend", "api", "mensa.py")
+BACKEND_DIR = os.path.join(BENCHMARK_DIR, "..", "Backend")
+
+
+def load_mensa():
+    # frontend/api is not a package, so load the script by path
+    spec = importlib.util.spec_from_file_location("mensa", MENSA_PATH)
+    mensa = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mensa)
+    return mensa
+
+
+def mensa_fixture_name(canteen, lang):
+    # canteen names may contain a slash, e.g. CasinoZEF/ZEI
+    return f"{canteen.replace('/', '-')}_{lang}"
+
+
+def load_mensa_fixtures():
+    """Return (name, lang, html) for every fixture, named <canteen>_<lang>.html."""
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(MENSA_FIXTURE_DIR, "*.html"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        with open(path, encoding="utf-8") as f:
+            fixtures.append((name, name.rsplit("_", 1)[1], f.read()))
+    return fixtures
+
+
+def load_pages():
+    """The made-up university pages in fixtures/rag/pages.jsonl."""
+    with open(os.path.join(RAG_FIXTURE_DIR, "pages.jsonl"), encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_questions():
+    with open(os.path.join(RAG_FIXTURE_DIR, "questions.txt"), encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def time_per_call(func, repeat, number):
+    """Seconds per call of every timing run, best first."""
+    return sorted(t / number for t in timeit.repeat(func, repeat=repeat, number=number))
+
+
+def best_time(func, repeat, number):
+    return time_per_call(func, repeat, number)[0]
+
+
+def median(times):
+    return statistics.median(times)
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def save_results(path, results):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def compare_results(baseline_path, results, threshold):
+    """Print every result slower than the baseline by more than `threshold`; returns them."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = []
+    for name, seconds in sorted(results.items()):
+        before = baseline.get(name)
+        if not before:
+            continue
+        change = seconds / before - 1
+        marker = ""
+        if change > threshold:
+            marker = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<40} {before * 1e6:>10.1f}us -> {seconds * 1e6:>10.1f}us {change:>+8.1%}{marker}")
+    return regressions
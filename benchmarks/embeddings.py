@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""Startup, latency, throughput and memory of the embedding backends.
+
+Usage:
+    python benchmarks/embeddings.py [--backends torch onnx] [--batch-size 32]
+
+Every backend of Backend/embedding_backends.py runs in a fresh process, so
+its startup time includes importing PyTorch or onnxruntime and its peak
+RSS is its own. The pages in benchmarks/fixtures/rag/pages.jsonl are split
+into chunks like Backend/ingest_website.py splits them. Each backend then
+embeds them in batches (throughput) and embeds the questions in
+benchmarks/fixtures/rag/questions.txt one at a time (latency).
+
+With both backends the ONNX vectors are also checked against the PyTorch
+ones that example_collection is built with:
+- the cosine similarity of every text's two vectors must be at least
+  ONNX_TOLERANCE (--tolerance);
+- the ONNX queries must find at least ONNX_MIN_OVERLAP (--min-overlap) of
+  the top k chunks the PyTorch queries find among the PyTorch chunk vectors.
+The script exits with status 1 if either is not met.
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+
+from common import (
+    BACKEND_DIR,
+    compare_results,
+    load_pages,
+    load_questions,
+    percentile,
+    save_results,
+)
+
+sys.path.insert(0, os.path.abspath(BACKEND_DIR))
+
+
+def peak_rss_mb():
+    # kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def split_fixture_pages(chunk_size, chunk_overlap):
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        is_separator_regex=False,
+    )
+    chunks = []
+    for page in load_pages():
+        chunks.extend(text_splitter.split_text(page["title"] + "\n" + page["text"]))
+    return chunks
+
+
+def measure(connection, backend, chunks, questions, batch_size, repeat):
+    # runs in its own process; sends the timings and vectors back
+    try:
+        start = time.perf_counter()
+        from embedding_backends import load_embeddings
+
+        model = load_embeddings(backend, batch_size=batch_size)
+        startup = time.perf_counter() - start
+        rss_loaded = peak_rss_mb()
+
+        # the first call initializes the model lazily
+        start = time.perf_counter()
+        model.embed_query(questions[0])
+        first_query = time.perf_counter() - start
+
+        query_times = []
+        for _ in range(repeat):
+            for question in questions:
+                start = time.perf_counter()
+                model.embed_query(question)
+                query_times.append(time.perf_counter() - start)
+
+        batch_times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            chunk_vectors = model.embed_documents(chunks)
+            batch_times.append(time.perf_counter() - start)
+
+        connection.send(
+            {
+                "startup": startup,
+                "first_query": first_query,
+                "query_times": query_times,
+                "batch_time": min(batch_times),
+                "rss_loaded": rss_loaded,
+                "rss_peak": peak_rss_mb(),
+                "chunk_vectors": chunk_vectors,
+                "question_vectors": [model.embed_query(question) for question in questions],
+            }
+        )
+    except Exception as e:
+        connection.send({"error": f"{type(e).__name__}: {e}"})
+
+
+def run_backend(backend, chunks, questions, batch_size, repeat):
+    # spawn, so no backend inherits modules or memory from this process
+    context = multiprocessing.get_context("spawn")
+    parent, child = context.Pipe()
+    process = context.Process(
+        target=measure, args=(child, backend, chunks, questions, batch_size, repeat)
+    )
+    process.start()
+    result = parent.recv()
+    process.join()
+    return result
+
+
+def normalized(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def top_k(question_vectors, chunk_vectors, k):
+    scores = question_vectors @ chunk_vectors.T
+    return [set(row) for row in np.argsort(-scores, axis=1)[:, :k]]
+
+
+def check_compatibility(reference, candidate, k):
+    """Cosine similarity of the candidate's vectors with the reference's, and
+    how many of the reference's top k chunks the candidate's queries find
+    among the reference's chunk vectors."""
+    reference_chunks = normalized(reference["chunk_vectors"])
+    reference_questions = normalized(reference["question_vectors"])
+    similarities = np.concatenate(
+        [
+            (reference_chunks * normalized(candidate["chunk_vectors"])).sum(axis=1),
+            (reference_questions * normalized(candidate["question_vectors"])).sum(axis=1),
+        ]
+    )
+    expected = top_k(reference_questions, reference_chunks, k)
+    found = top_k(normalized(candidate["question_vectors"]), reference_chunks, k)
+    overlap = [len(a & b) / k for a, b in zip(expected, found)]
+    return float(similarities.min()), float(similarities.mean()), float(np.mean(overlap))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx"], choices=["torch", "onnx"])
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the questions and chunks.")
+    parser.add_argument("--chunk-size", type=int, default=300)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--k", type=int, default=4, help="Chunks compared per question.")
+    parser.add_argument("--tolerance", type=float, default=None, help="Default: ONNX_TOLERANCE.")
+    parser.add_argument("--min-overlap", type=float, default=None, help="Default: ONNX_MIN_OVERLAP.")
+    parser.add_argument("--save", type=str, default=None, help="Write the results to this JSON file.")
+    parser.add_argument("--compare", type=str, default=None, help="Compare with a saved JSON file.")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    from embedding_backends import ONNX_MIN_OVERLAP, ONNX_TOLERANCE
+
+    tolerance = ONNX_TOLERANCE if args.tolerance is None else args.tolerance
+    min_overlap = ONNX_MIN_OVERLAP if args.min_overlap is None else args.min_overlap
+    chunks = split_fixture_pages(args.chunk_size, args.chunk_overlap)
+    questions = load_questions()
+    print(f"{len(chunks)} chunks, {len(questions)} questions, batch size {args.batch_size}")
+    print()
+    print(
+        f"{'backend':<8} {'startup':>9} {'first':>9} {'query p50':>10} {'query p95':>10}"
+        f" {'chunks/s':>9} {'RSS load':>9} {'RSS peak':>9}"
+    )
+
+    measured = {}
+    results = {}
+    for backend in args.backends:
+        result = run_backend(backend, chunks, questions, args.batch_size, args.repeat)
+        if "error" in result:
+            print(f"{backend:<8} failed: {result['error']}")
+            continue
+        measured[backend] = result
+        query_times = result["query_times"]
+        print(
+            f"{backend:<8} {result['startup']:>8.2f}s {result['first_query'] * 1e3:>7.1f}ms"
+            f" {percentile(query_times, 0.5) * 1e3:>8.2f}ms {percentile(query_times, 0.95) * 1e3:>8.2f}ms"
+            f" {len(chunks) / result['batch_time']:>9.1f}"
+            f" {result['rss_loaded']:>7.0f}MB {result['rss_peak']:>7.0f}MB"
+        )
+        prefix = f"embedding.{backend}"
+        results[f"{prefix}.startup"] = result["startup"]
+        results[f"{prefix}.query_p50"] = percentile(query_times, 0.5)
+        results[f"{prefix}.query_p95"] = percentile(query_times, 0.95)
+        results[f"{prefix}.seconds_per_chunk"] = result["batch_time"] / len(chunks)
+    print("startup = import and model load in a fresh process, first = first query after that")
+
+    failed = False
+    if "torch" in measured and "onnx" in measured:
+        lowest, mean, overlap = check_compatibility(measured["torch"], measured["onnx"], args.k)
+        print()
+        print(f"ONNX vs PyTorch cosine similarity: min {lowest:.4f}, mean {mean:.4f} (tolerance {tolerance})")
+        print(f"PyTorch top {args.k} chunks also found by ONNX queries: {overlap:.1%} (at least {min_overlap:.0%})")
+        if lowest < tolerance:
+            print("ONNX vectors are outside the tolerance")
+            failed = True
+        if overlap < min_overlap:
+            print("ONNX queries find too few of the PyTorch chunks")
+            failed = True
+
+    if args.save:
+        save_results(args.save, results)
+    if args.compare:
+        print()
+        if compare_results(args.compare, results, args.threshold):
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
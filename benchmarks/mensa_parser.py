@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""Compare the mensa.py response parser with the string-mode parser it replaced.
+
+Usage: python benchmarks/mensa_parser.py [--repeat N]
+
+Every fixture in benchmarks/fixtures/mensa is parsed by both parsers and
+the results are checked to be equal. Two times are printed per parser: a
+full parse, and a replay of the recorded tag and text events through the
+parser's handlers. The rework was about skipping unknown blocks instead of
+aborting the parse, not about speed: both parsers take about as long, and
+most of a full parse is spent in html.parser itself. The times are there
+to catch a regression.
+"""
+import argparse
+import contextlib
+import io
+from html.parser import HTMLParser
+
+from common import best_time, load_mensa, load_mensa_fixtures
+
+mensa = load_mensa()
+
+
+class LegacyMensaResponseParser(HTMLParser):
+    """The parser as it was before the state machine rework, kept for comparison."""
+
+    def __init__(self, lang, verbose=False):
+        super().__init__()
+        self.curr_category = None
+        self.curr_meal = None
+        self.last_nonignored_tag = None
+        self.categories = []
+        self.mode = "INIT"
+        self.lang = lang
+        self.verbose = verbose
+
+    def start_new_category(self):
+        if self.curr_category:
+            if self.curr_meal:
+                self.curr_category.add_meal(self.curr_meal)
+                self.curr_meal = None
+            self.categories.append(self.curr_category)
+            self.curr_category = None
+        self.mode = "NEW_CAT"
+
+    def start_new_meal(self):
+        if not self.curr_category:
+            self.curr_category = mensa.Category("DUMMY-Name")
+        if self.curr_meal:
+            self.curr_category.add_meal(self.curr_meal)
+            self.curr_meal = None
+        self.mode = "NEW_MEAL"
+
+    def handle_starttag(self, tag, attrs):
+        if attrs or tag not in ["h2", "h5", "strong", "p", "th", "td", "br"]:
+            self.mode = "IGNORE"
+            return
+        self.last_nonignored_tag = tag
+        if tag == "h2":
+            self.start_new_category()
+        elif tag == "h5":
+            self.start_new_meal()
+        elif tag == "strong":
+            self.mode = "NEW_INFOS"
+        elif tag == "p":
+            if not self.curr_meal and not self.curr_category:
+                self.mode = "INFO"
+        elif tag == "th":
+            self.mode = "NEW_PRICE_CAT"
+
+    def parse_price(self, price):
+        return int("".join(digit for digit in price if digit.isdigit()))
+
+    def handle_data(self, data):
+        content_strings = mensa.content_strings
+        if self.mode == "IGNORE" or not data.strip():
+            return
+        if self.mode in ["INIT", "INFO"]:
+            print(data)
+            return
+        data = data.strip()
+        if self.mode == "NEW_CAT":
+            self.curr_category = mensa.Category(data)
+        elif self.mode == "NEW_MEAL":
+            self.curr_meal = mensa.Meal(data)
+        elif self.mode == "NEW_INFOS":
+            if data == content_strings["NEW_INFOS_ALLERGENS"][self.lang]:
+                self.mode = "NEW_ALLERGENS"
+            elif data == content_strings["NEW_INFOS_ADDITIVES"][self.lang]:
+                self.mode = "NEW_ADDITIVES"
+            elif data in mensa.co2_strings:
+                self.curr_meal.co2_tag = mensa.co2_strings[data]
+                self.mode = "IGNORE"
+            else:
+                raise NotImplementedError(f"Mode NEW_INFOS with data {data}")
+        elif self.mode == "NEW_ALLERGENS":
+            self.curr_meal.add_allergen(data)
+        elif self.mode == "NEW_ADDITIVES":
+            self.curr_meal.add_additive(data)
+        elif self.mode == "NEW_PRICE_CAT":
+            if data == content_strings["PRICE_CATEGORY_STUDENT"][self.lang]:
+                self.mode = "NEW_PRICE_STUDENT"
+            elif data == content_strings["PRICE_CATEGORY_STAFF"][self.lang]:
+                self.mode = "NEW_PRICE_STAFF"
+            elif data == content_strings["PRICE_CATEGORY_GUEST"][self.lang]:
+                self.mode = "NEW_PRICE_GUEST"
+            else:
+                raise NotImplementedError(f"Mode NEW_PRICE_CAT with data {data}")
+        elif self.mode == "NEW_PRICE_STUDENT":
+            assert self.last_nonignored_tag == "td"
+            self.curr_meal.student_price = self.parse_price(data)
+        elif self.mode == "NEW_PRICE_STAFF":
+            assert self.last_nonignored_tag == "td"
+            self.curr_meal.staff_price = self.parse_price(data)
+        elif self.mode == "NEW_PRICE_GUEST":
+            assert self.last_nonignored_tag == "td"
+            self.curr_meal.guest_price = self.parse_price(data)
+        else:
+            raise NotImplementedError(f"{self.last_nonignored_tag} with data {data}")
+
+    def close(self):
+        super().close()
+        self.start_new_category()
+
+
+def parse(parser_class, html, lang):
+    parser = parser_class(lang=lang)
+    parser.feed(html)
+    parser.close()
+    return parser.categories
+
+
+class EventRecorder(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.events = []
+
+    def handle_starttag(self, tag, attrs):
+        self.events.append((True, tag, attrs))
+
+    def handle_data(self, data):
+        self.events.append((False, data, None))
+
+
+def record_events(html):
+    recorder = EventRecorder()
+    recorder.feed(html)
+    recorder.close()
+    return recorder.events
+
+
+def replay(parser_class, events, lang):
+    parser = parser_class(lang=lang)
+    for is_tag, value, attrs in events:
+        if is_tag:
+            parser.handle_starttag(value, attrs)
+        else:
+            parser.handle_data(value)
+    parser.close()
+    return parser.categories
+
+
+def summary(categories):
+    return [
+        (
+            cat.title,
+            [
+                (
+                    meal.title,
+                    meal.allergens,
+                    meal.additives,
+                    meal.student_price,
+                    meal.staff_price,
+                    meal.guest_price,
+                    meal.co2_tag,
+                )
+                for meal in cat.meals
+            ],
+        )
+        for cat in categories
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Timing runs per fixture.")
+    parser.add_argument("--number", type=int, default=200, help="Parses per timing run.")
+    args = parser.parse_args()
+
+    results = []
+    # the legacy parser prints every notice it finds
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name, lang, html in load_mensa_fixtures():
+            legacy = parse(LegacyMensaResponseParser, html, lang)
+            current = parse(mensa.SimpleMensaResponseParser, html, lang)
+            assert summary(legacy) == summary(current), f"parsers disagree on {name}"
+
+            events = record_events(html)
+            for mode, run, data in (("parse", parse, html), ("handlers", replay, events)):
+                legacy_time = best_time(
+                    lambda: run(LegacyMensaResponseParser, data, lang), args.repeat, args.number
+                )
+                current_time = best_time(
+                    lambda: run(mensa.SimpleMensaResponseParser, data, lang),
+                    args.repeat,
+                    args.number,
+                )
+                results.append((name, mode, legacy_time, current_time))
+
+    print(f"{'fixture':<24} {'mode':<9} {'legacy':>10} {'current':>10} {'ratio':>8}")
+    for name, mode, legacy_time, current_time in results:
+        print(
+            f"{name:<24} {mode:<9} {legacy_time * 1e6:>8.1f}us {current_time * 1e6:>8.1f}us"
+            f" {legacy_time / current_time:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
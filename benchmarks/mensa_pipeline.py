@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""Time every stage of the mensa.py pipeline on the recorded fixtures.
+
+Usage:
+    python benchmarks/mensa_pipeline.py [--save results.json] [--compare results.json]
+
+A local stand-in for the Studierendenwerk endpoint serves
+benchmarks/fixtures/mensa/<canteen>_<lang>.html, so no request leaves the
+machine. The stages are:
+
+    parse        SimpleMensaResponseParser on the raw HTML
+    filter       get_menu() on a cached menu, for every filter combination
+    render_*     each output format of a filtered menu
+    end_to_end   get_menu_json() against the stand-in server with a cold cache
+    cached       get_menu_json() with a warm cache
+
+--save writes the best time per stage to a JSON file. --compare reads
+such a file, prints the change per stage and exits with status 1 if any
+stage got slower by more than --threshold.
+"""
+import argparse
+import json
+import sys
+import threading
+import urllib.parse
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from common import (
+    compare_results,
+    load_mensa,
+    load_mensa_fixtures,
+    median,
+    mensa_fixture_name,
+    save_results,
+    time_per_call,
+)
+
+mensa = load_mensa()
+
+FILTERS = [
+    dict(),
+    dict(filtered_categories=["Dessert", "Buffet"]),
+    dict(filter_mode="vegetarian"),
+    dict(filter_mode="vegan", gluten_free=True),
+]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Answers the mensa form POST with the fixture of the requested canteen and language."""
+
+    fixtures = {}
+    latency = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        form = urllib.parse.parse_qs(self.rfile.read(length).decode())
+        canteen_id = form["tx_festwb_mealsajax[canteen]"][0]
+        language_id = form["tx_festwb_mealsajax[language]"][0]
+        canteen = next(name for name, id in mensa.canteen_id_dict.items() if id == canteen_id)
+        lang = next(name for name, id in mensa.language_id_dict.items() if id == language_id)
+
+        body = self.fixtures.get(mensa_fixture_name(canteen, lang), "").encode("utf-8")
+        if self.latency:
+            threading.Event().wait(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stand_in(fixtures, latency):
+    StandInHandler.fixtures = {name: html for name, _, html in fixtures}
+    StandInHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+def fixture_jobs(fixtures):
+    by_name = {
+        mensa_fixture_name(canteen, lang): (canteen, lang)
+        for canteen in mensa.canteen_id_dict
+        for lang in mensa.language_id_dict
+    }
+    return [(by_name[name], html) for name, _, html in fixtures if name in by_name]
+
+
+def run_benchmarks(jobs, url, repeat, number):
+    """Return {stage: [seconds per menu of every timing run]}."""
+    date = "2026-01-05"
+    menu_cache = mensa.menu_cache
+    timings = {}
+
+    def parse_all():
+        for (canteen, lang), html in jobs:
+            parser = mensa.SimpleMensaResponseParser(lang=lang)
+            parser.feed(html)
+            parser.close()
+
+    def warm_cache():
+        menu_cache.entries.clear()
+        for (canteen, lang), _ in jobs:
+            menu_cache.get(date, canteen, lang, url=url)
+
+    def filter_all():
+        for (canteen, lang), _ in jobs:
+            for options in FILTERS:
+                mensa.get_menu(date, canteen, lang, url=url, **options)
+
+    warm_cache()
+    menus = [
+        mensa.get_menu(date, canteen, lang, url=url, **FILTERS[1]) for (canteen, lang), _ in jobs
+    ]
+    renderers = {
+        "render_json": lambda menu: json.dumps(mensa.render_json(menu), ensure_ascii=False),
+        "render_markdown": lambda menu: mensa.render_markdown(menu),
+        "render_text": lambda menu: mensa.render_text(menu, colors=True, show_all_prices=True),
+        "render_xml": lambda menu: ET.tostring(mensa.render_xml(menu)),
+    }
+
+    def end_to_end():
+        menu_cache.entries.clear()
+        for (canteen, lang), _ in jobs:
+            mensa.get_menu_json(date, canteen, FILTERS[1]["filtered_categories"], lang, url=url)
+
+    def cached():
+        for (canteen, lang), _ in jobs:
+            mensa.get_menu_json(date, canteen, FILTERS[1]["filtered_categories"], lang, url=url)
+
+    per_menu = len(jobs)
+    timings["parse"] = [t / per_menu for t in time_per_call(parse_all, repeat, number)]
+    timings["filter"] = [
+        t / (per_menu * len(FILTERS)) for t in time_per_call(filter_all, repeat, number)
+    ]
+    for stage, render in renderers.items():
+        timings[stage] = [
+            t / per_menu
+            for t in time_per_call(lambda: [render(menu) for menu in menus], repeat, number)
+        ]
+    # the network round trips dominate, so fewer runs are enough
+    timings["end_to_end"] = [
+        t / per_menu for t in time_per_call(end_to_end, repeat, max(1, number // 10))
+    ]
+    warm_cache()
+    timings["cached"] = [t / per_menu for t in time_per_call(cached, repeat, number)]
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Timing runs per stage.")
+    parser.add_argument("--number", type=int, default=20, help="Passes over all fixtures per run.")
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Seconds the stand-in server waits before answering, to mimic the real upstream.",
+    )
+    parser.add_argument("--save", type=str, default=None, help="Write the results to this JSON file.")
+    parser.add_argument("--compare", type=str, default=None, help="Compare with a saved JSON file.")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Relative slowdown that counts as a regression with --compare. Defaults to 0.2.",
+    )
+    args = parser.parse_args()
+
+    # cached menus must never be served from or written to the real archive
+    mensa.menu_cache.archive = None
+    fixtures = load_mensa_fixtures()
+    jobs = fixture_jobs(fixtures)
+    server, url = start_stand_in(fixtures, args.latency)
+    try:
+        timings = run_benchmarks(jobs, url, args.repeat, args.number)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    print(f"{len(jobs)} menus, times per menu")
+    print(f"{'stage':<18} {'best':>10} {'median':>10}")
+    for stage, times in timings.items():
+        print(f"{stage:<18} {times[0] * 1e6:>8.1f}us {median(times) * 1e6:>8.1f}us")
+
+    # the best run is the least affected by other load on the machine
+    results = {f"mensa.{stage}": times[0] for stage, times in timings.items()}
+    if args.save:
+        save_results(args.save, results)
+    if args.compare:
+        print()
+        if compare_results(args.compare, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
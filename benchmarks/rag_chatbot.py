@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""Latency and throughput of the RAG chatbot's stream_response, fully offline.
+
+Usage:
+    python benchmarks/rag_chatbot.py [--concurrency 1 4 16] [--k 5] [--chunk-size 300]
+
+The pages in benchmarks/fixtures/rag/pages.jsonl are split and embedded
+into a fresh Chroma collection in a scratch directory, exactly like
+Backend/ingest_website.py does. Backend/chatbot.py is then imported with
+OPENAI_API_BASE pointing at a local fake of the OpenAI chat completions
+API, which streams a fixed answer with a configurable time to first token
+and token rate. The questions in benchmarks/fixtures/rag/questions.txt are
+asked over and over at every concurrency level. Unless --answer-cache or
+--coalesce is given, every request runs its own retrieval and LLM call.
+
+Reported per request: embedding and retrieval latency, prompt tokens, time
+to first token and total latency (p50 / p95), plus requests per second.
+Only the embedding model and the LLM are real work or simulated; nothing
+leaves the machine once the model is downloaded.
+"""
+import argparse
+import asyncio
+import contextlib
+import contextvars
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from common import (
+    BACKEND_DIR,
+    BENCHMARK_DIR,
+    compare_results,
+    load_pages,
+    load_questions,
+    percentile,
+    save_results,
+)
+
+FAKE_ANSWER = (
+    "According to the university's pages, you can find the details on the "
+    "service's website or ask the responsible office during its opening hours."
+)
+
+# timings of the request that is being processed in the current task
+current_request = contextvars.ContextVar("current_request")
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """Minimal OpenAI-compatible POST /chat/completions, streaming or not."""
+
+    time_to_first_token = 0.2
+    token_delay = 0.01
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length))
+        words = FAKE_ANSWER.split(" ")
+        tokens = [word if i == 0 else " " + word for i, word in enumerate(words)]
+        time.sleep(self.time_to_first_token)
+
+        if not request.get("stream"):
+            body = json.dumps(self.completion("".join(tokens), request)).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(self.token_delay)
+            self.send_chunk(request, {"content": token}, None)
+        self.send_chunk(request, {}, "stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def send_chunk(self, request, delta, finish_reason):
+        chunk = {
+            "id": "chatcmpl-benchmark",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.get("model", "benchmark"),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+    @staticmethod
+    def completion(content, request):
+        return {
+            "id": "chatcmpl-benchmark",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "benchmark"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    # with the default listen backlog of 5, connections beyond it at higher
+    # concurrency are dropped and retried a second later, which shows up as
+    # time to first token
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def serve_fake_llm(connection, time_to_first_token, token_delay):
+    FakeLLMHandler.time_to_first_token = time_to_first_token
+    FakeLLMHandler.token_delay = token_delay
+    server = FakeLLMServer(("127.0.0.1", 0), FakeLLMHandler)
+    connection.send(server.server_address[1])
+    server.serve_forever()
+
+
+def start_fake_llm(time_to_first_token, token_delay):
+    # a separate process, so the fake does not compete with the chatbot for the GIL
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(
+        target=serve_fake_llm, args=(child, time_to_first_token, token_delay), daemon=True
+    )
+    process.start()
+    return process, f"http://127.0.0.1:{parent.recv()}/v1"
+
+
+def import_chatbot(workdir, llm_url):
+    # chatbot.py reads its configuration from the environment and opens
+    # chroma_db relative to the working directory; load() is what the
+    # server's lifespan runs at startup
+    os.environ["OPENAI_API_BASE"] = llm_url
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.abspath(BACKEND_DIR))
+    import chatbot
+
+    # the startup profile is printed as well
+    with contextlib.redirect_stdout(io.StringIO()):
+        chatbot.load()
+    return chatbot
+
+
+def count_tokens(text):
+    # the same count the chatbot budgets its prompt with
+    from context_builder import count_tokens
+
+    return count_tokens(text)
+
+
+def build_fixture_collection(chatbot, chunk_size, chunk_overlap):
+    from langchain_core.documents import Document
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    from ingest_website import chunk_ids
+    from lexical_index import BM25Index, lexical_index_path
+
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        is_separator_regex=False,
+    )
+    total = 0
+    for page in load_pages():
+        document = Document(
+            page_content=page["title"] + "\n" + page["text"],
+            metadata={"source": page["url"], "title": page["title"]},
+        )
+        chunks = text_splitter.split_documents([document])
+        chatbot.vector_store.add_documents(chunks, ids=chunk_ids(page["url"], len(chunks)))
+        total += len(chunks)
+    BM25Index.from_collection(chatbot.vector_store._collection).save(
+        lexical_index_path(chatbot.CHROMA_PATH)
+    )
+    return total
+
+
+def instrument(chatbot):
+    """Wrap the stages of stream_response so every request records its own timings."""
+    embed_query = chatbot.embed_query
+    retrieve = chatbot.retrieve
+    build_prompt = chatbot.build_prompt
+
+    async def timed_embed_query(message):
+        start = time.perf_counter()
+        try:
+            return await embed_query(message)
+        finally:
+            current_request.get()["embed"] = time.perf_counter() - start
+
+    async def timed_retrieve(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await retrieve(*args, **kwargs)
+        finally:
+            current_request.get()["retrieval"] = time.perf_counter() - start
+
+    def measured_build_prompt(*args, **kwargs):
+        prompt = build_prompt(*args, **kwargs)
+        current_request.get()["prompt_tokens"] = count_tokens(prompt)
+        return prompt
+
+    chatbot.embed_query = timed_embed_query
+    chatbot.retrieve = timed_retrieve
+    chatbot.build_prompt = measured_build_prompt
+
+
+async def ask(chatbot, question, history):
+    record = {}
+    current_request.set(record)
+    start = time.perf_counter()
+    async for _ in chatbot.stream_response(question, history):
+        if "ttft" not in record:
+            record["ttft"] = time.perf_counter() - start
+    record["total"] = time.perf_counter() - start
+    return record
+
+
+async def run_level(chatbot, questions, requests, concurrency, history):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def worker(i):
+        async with semaphore:
+            return await ask(chatbot, questions[i % len(questions)], history)
+
+    start = time.perf_counter()
+    records = await asyncio.gather(*(worker(i) for i in range(requests)))
+    return records, time.perf_counter() - start
+
+
+def format_ms(values, fraction, width):
+    # requests answered from the answer cache skip embedding and retrieval,
+    # so a column can be empty
+    if not values:
+        return f"{'-':>{width}}"
+    return f"{percentile(values, fraction) * 1e3:>{width - 2}.1f}ms"
+
+
+def synthetic_history(turns):
+    # the frontend sends [user message, bot answer] pairs
+    return [[f"Question number {i} about the university?", FAKE_ANSWER] for i in range(turns)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=40, help="Requests per concurrency level.")
+    parser.add_argument("--k", type=int, default=None, help="Chunks that reach the prompt.")
+    parser.add_argument(
+        "--candidates", type=int, default=None, help="Dense and BM25 hits fused per question."
+    )
+    parser.add_argument(
+        "--lexical-budget",
+        type=float,
+        default=None,
+        help="Seconds the BM25 search may take; 0 compares against dense retrieval only.",
+    )
+    parser.add_argument("--chunk-size", type=int, default=300)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument(
+        "--history-turns",
+        type=int,
+        default=0,
+        help="Send this many earlier question/answer pairs with every request.",
+    )
+    parser.add_argument(
+        "--answer-cache",
+        action="store_true",
+        help="Keep the semantic answer cache enabled; by default every request reaches the LLM.",
+    )
+    parser.add_argument(
+        "--coalesce",
+        action="store_true",
+        help="Let concurrent identical questions share one answer; by default each is answered on its own.",
+    )
+    parser.add_argument("--ttft", type=float, default=0.2, help="Fake LLM time to first token (s).")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Fake LLM delay per token (s).")
+    parser.add_argument("--save", type=str, default=None, help="Write the results to this JSON file.")
+    parser.add_argument("--compare", type=str, default=None, help="Compare with a saved JSON file.")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    save_path = os.path.abspath(args.save) if args.save else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    workdir = tempfile.mkdtemp(prefix="rag-benchmark-")
+    llm_process, llm_url = start_fake_llm(args.ttft, args.token_delay)
+    try:
+        chatbot = import_chatbot(workdir, llm_url)
+        if args.k is not None:
+            chatbot.num_results = args.k
+        if args.candidates is not None:
+            chatbot.num_candidates = args.candidates
+        if args.lexical_budget is not None:
+            chatbot.LEXICAL_BUDGET = args.lexical_budget
+        if not args.answer_cache:
+            chatbot.answer_cache.max_size = 0
+        # questions repeat once --requests exceeds the fixture questions, and
+        # coalesced followers would skip retrieval and the LLM call
+        if not args.coalesce:
+            chatbot.COALESCE_QUESTIONS = False
+
+        start = time.perf_counter()
+        chunks = build_fixture_collection(chatbot, args.chunk_size, args.chunk_overlap)
+        print(f"Indexed {chunks} chunks in {time.perf_counter() - start:.1f}s")
+
+        instrument(chatbot)
+        questions = load_questions()
+        history = synthetic_history(args.history_turns)
+        # the first question pays for lazy model initialisation
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(ask(chatbot, questions[0], history))
+
+        results = {}
+        header = (
+            f"{'conc':>4} {'req/s':>7} {'embed p50':>10} {'retr p50':>9} {'retr p95':>9}"
+            f" {'prompt':>7} {'ttft p50':>9} {'ttft p95':>9} {'total p50':>10} {'total p95':>10}"
+        )
+        print(header)
+        for concurrency in args.concurrency:
+            # stream_response prints every prompt
+            with contextlib.redirect_stdout(io.StringIO()):
+                records, elapsed = asyncio.run(
+                    run_level(chatbot, questions, args.requests, concurrency, history)
+                )
+            columns = {
+                name: [r[name] for r in records if name in r]
+                for name in ("embed", "retrieval", "prompt_tokens", "ttft", "total")
+            }
+            throughput = len(records) / elapsed
+            print(
+                f"{concurrency:>4} {throughput:>7.1f}"
+                f" {format_ms(columns['embed'], 0.5, 10)}"
+                f" {format_ms(columns['retrieval'], 0.5, 9)}"
+                f" {format_ms(columns['retrieval'], 0.95, 9)}"
+                f" {round(statistics.mean(columns['prompt_tokens'])) if columns['prompt_tokens'] else '-':>7}"
+                f" {format_ms(columns['ttft'], 0.5, 9)}"
+                f" {format_ms(columns['ttft'], 0.95, 9)}"
+                f" {format_ms(columns['total'], 0.5, 10)}"
+                f" {format_ms(columns['total'], 0.95, 10)}"
+            )
+            prefix = f"rag.c{concurrency}"
+            if columns["retrieval"]:
+                results[f"{prefix}.retrieval_p50"] = percentile(columns["retrieval"], 0.5)
+            results[f"{prefix}.ttft_p95"] = percentile(columns["ttft"], 0.95)
+            results[f"{prefix}.total_p95"] = percentile(columns["total"], 0.95)
+            results[f"{prefix}.seconds_per_request"] = elapsed / len(records)
+        print("prompt = mean prompt length in tokens")
+    finally:
+        llm_process.terminate()
+        os.chdir(BENCHMARK_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if save_path:
+        save_results(save_path, results)
+    if compare_path:
+        print()
+        if compare_results(compare_path, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,18 @@ import sys
 from html.parser import HTMLParser
 import time
 import json
-from typing import Dict, List, Optional, Set
+import threading
+import urllib.parse
+from concurrent.futures import Future, ThreadPoolExecutor
+from enum import IntEnum, auto
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Set, Tuple
 import requests
+from requests.adapters import HTTPAdapter
 import datetime
 import os.path
+import random
+import sqlite3
 
 # Try to import colorama, use dummy colors if not available
 try:
@@ -99,6 +107,29 @@ other_allergens: Dict[str, Set[str]] = {
     "en": set(),
 }
 
+# Diet flags, computed once per meal while parsing so that filtering is a
+# single integer test instead of set intersections
+FLAG_MEAT = 1
+FLAG_OVO_LACTO = 2
+FLAG_GLUTEN = 4
+
+
+def build_allergen_flags() -> Dict[str, int]:
+    # allergen strings of both languages mapped to their FLAG_* bits
+    flags: Dict[str, int] = {}
+    for flag, allergens_by_lang in (
+        (FLAG_MEAT, meat_allergens),
+        (FLAG_OVO_LACTO, ovo_lacto_allergens),
+        (FLAG_GLUTEN, gluten_allergens),
+    ):
+        for allergens in allergens_by_lang.values():
+            for allergen in allergens:
+                flags[allergen] = flags.get(allergen, 0) | flag
+    return flags
+
+
+allergen_flags = build_allergen_flags()
+
 canteen_id_dict = {
     "SanktAugustin": "1",
     "CAMPO": "2",
@@ -138,6 +169,44 @@ content_strings = {
     },
 }
 
+MENSA_URL = "https://www.studierendenwerk-bonn.de/?type=1732731666"
+
+# Menus are served from the cache for MENU_CACHE_TTL seconds. For another
+# MENU_CACHE_STALE_TTL seconds the old menu is still returned immediately
+# while a background thread fetches a fresh copy.
+MENU_CACHE_TTL = 15 * 60
+MENU_CACHE_STALE_TTL = 60 * 60
+REQUEST_TIMEOUT = 10
+# A failed request is retried FETCH_RETRIES times with jittered exponential
+# backoff, but one lookup never takes longer than FETCH_DEADLINE seconds
+FETCH_RETRIES = 2
+FETCH_BACKOFF = 0.5
+FETCH_DEADLINE = 15
+
+# After CIRCUIT_FAILURE_THRESHOLD failed lookups in a row the upstream is
+# considered down and lookups fail immediately for CIRCUIT_RESET_TIMEOUT seconds
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 60
+
+# number of menus fetched at the same time in batch mode
+BATCH_WORKERS = 8
+# one request to /api/mensa/batch may cover at most BATCH_MAX_DAYS days and
+# BATCH_MAX_MENUS menus (days x canteens x languages), so a single GET cannot
+# fan out into an unbounded number of upstream lookups
+BATCH_MAX_DAYS = 10
+BATCH_MAX_MENUS = 80
+
+# The prefetcher refreshes the menus of the next PREFETCH_DAYS working days
+# for all canteens and languages every PREFETCH_INTERVAL seconds
+PREFETCH_DAYS = 2
+PREFETCH_INTERVAL = 10 * 60
+
+# Every menu fetched from the Studierendenwerk is stored in this SQLite file.
+# Set MENSA_ARCHIVE to another path, or to an empty string to disable it.
+MENSA_ARCHIVE_PATH = os.environ.get(
+    "MENSA_ARCHIVE", os.path.expanduser("~/.cache/bonn-mensa/menus.sqlite3")
+)
+
 # CO2 info is always in German
 co2_strings = {
     "Mindestens 50% besser als der Durchschnitt.": "CO2_TAG_GREEN",
@@ -190,6 +259,17 @@ output_strs = {
 
 
 class Meal:
+    __slots__ = (
+        "title",
+        "allergens",
+        "additives",
+        "student_price",
+        "staff_price",
+        "guest_price",
+        "co2_tag",
+        "flags",
+    )
+
     def __init__(self, title: str) -> None:
         self.title = title
         self.allergens: List[str] = []
@@ -198,15 +278,20 @@ class Meal:
         self.staff_price: Optional[int] = None
         self.guest_price: Optional[int] = None
         self.co2_tag: Optional[str] = None
+        # FLAG_* bits of all allergens added so far
+        self.flags = 0
 
     def add_allergen(self, allergen: str) -> None:
         self.allergens.append(allergen)
+        self.flags |= allergen_flags.get(allergen, 0)
 
     def add_additive(self, additive: str) -> None:
         self.additives.append(additive)
 
 
 class Category:
+    __slots__ = ("title", "meals")
+
     def __init__(self, title: str) -> None:
         self.title = title
         self.meals: List[Meal] = []
@@ -215,20 +300,84 @@ class Category:
         self.meals.append(meal)
 
 
+class ParserMode(IntEnum):
+    INIT = auto()
+    IGNORE = auto()
+    INFO = auto()
+    NEW_CAT = auto()
+    NEW_MEAL = auto()
+    NEW_INFOS = auto()
+    NEW_ALLERGENS = auto()
+    NEW_ADDITIVES = auto()
+    NEW_PRICE_CAT = auto()
+    NEW_PRICE_STUDENT = auto()
+    NEW_PRICE_STAFF = auto()
+    NEW_PRICE_GUEST = auto()
+
+
+# only attribute-less tags of these kinds carry menu data
+PARSED_TAGS = frozenset(["h2", "h5", "strong", "p", "th", "td", "br"])
+
+
+def parse_price(price: str) -> int:
+    """Turn "4,41 €" into 441."""
+    try:
+        return int(price.rstrip(" €\xa0").replace(",", "").replace(".", ""))
+    except ValueError:
+        return int("".join(digit for digit in price if digit.isdigit()))
+
+
 class SimpleMensaResponseParser(HTMLParser):
+    """State machine over the HTML snippet returned by the Studierendenwerk.
+
+    Text that is not part of a meal, like opening hours, is collected in
+    `infos`. Blocks the parser does not recognise are skipped.
+    """
+
     def __init__(self, lang: str, verbose: bool = False):
         super().__init__()
         self.curr_category: Optional[Category] = None
         self.curr_meal: Optional[Meal] = None
 
-        self.last_tag: Optional[str] = None
         self.last_nonignored_tag: Optional[str] = None
         self.categories: List[Category] = []
-        self.mode = "INIT"
+        self.infos: List[str] = []
+        self.mode = ParserMode.INIT
 
         self.lang = lang
         self.verbose = verbose
 
+        # the labels of the info blocks and price rows in this language
+        self.info_modes = {
+            content_strings["NEW_INFOS_ALLERGENS"][lang]: ParserMode.NEW_ALLERGENS,
+            content_strings["NEW_INFOS_ADDITIVES"][lang]: ParserMode.NEW_ADDITIVES,
+        }
+        self.price_modes = {
+            content_strings["PRICE_CATEGORY_STUDENT"][lang]: ParserMode.NEW_PRICE_STUDENT,
+            content_strings["PRICE_CATEGORY_STAFF"][lang]: ParserMode.NEW_PRICE_STAFF,
+            content_strings["PRICE_CATEGORY_GUEST"][lang]: ParserMode.NEW_PRICE_GUEST,
+        }
+        self.tag_handlers = {
+            "h2": self.start_new_category,
+            "h5": self.start_new_meal,
+            "strong": self.start_infos,
+            "p": self.start_paragraph,
+            "th": self.start_price_category,
+        }
+        self.data_handlers = {
+            ParserMode.INIT: self.infos.append,
+            ParserMode.INFO: self.infos.append,
+            ParserMode.NEW_CAT: self.handle_category,
+            ParserMode.NEW_MEAL: self.handle_meal,
+            ParserMode.NEW_INFOS: self.handle_infos,
+            ParserMode.NEW_ALLERGENS: self.handle_allergen,
+            ParserMode.NEW_ADDITIVES: self.handle_additive,
+            ParserMode.NEW_PRICE_CAT: self.handle_price_category,
+            ParserMode.NEW_PRICE_STUDENT: self.handle_price,
+            ParserMode.NEW_PRICE_STAFF: self.handle_price,
+            ParserMode.NEW_PRICE_GUEST: self.handle_price,
+        }
+
     def start_new_category(self):
         if self.curr_category:
             if self.curr_meal:
@@ -237,7 +386,7 @@ class SimpleMensaResponseParser(HTMLParser):
             self.categories.append(self.curr_category)
             self.curr_category = None
 
-        self.mode = "NEW_CAT"
+        self.mode = ParserMode.NEW_CAT
 
     def start_new_meal(self):
         if not self.curr_category:
@@ -247,151 +396,735 @@ class SimpleMensaResponseParser(HTMLParser):
             self.curr_category.add_meal(self.curr_meal)
             self.curr_meal = None
 
-        self.mode = "NEW_MEAL"
+        self.mode = ParserMode.NEW_MEAL
+
+    def start_infos(self):
+        self.mode = ParserMode.NEW_INFOS
+
+    def start_paragraph(self):
+        if not self.curr_meal and not self.curr_category:
+            self.mode = ParserMode.INFO
+
+    def start_price_category(self):
+        self.mode = ParserMode.NEW_PRICE_CAT
 
     def handle_starttag(self, tag, attrs):
         # skip non-empty attributes
-        if attrs or tag not in ["h2", "h5", "strong", "p", "th", "td", "br"]:
-            self.mode = "IGNORE"
+        if attrs or tag not in PARSED_TAGS:
+            self.mode = ParserMode.IGNORE
             return
 
         self.last_nonignored_tag = tag
-        if tag == "h2":
-            self.start_new_category()
-        elif tag == "h5":
-            self.start_new_meal()
-        elif tag == "strong":
-            self.mode = "NEW_INFOS"
-        elif tag == "p":
-            if not self.curr_meal and not self.curr_category:
-                self.mode = "INFO"
-        elif tag == "th":
-            self.mode = "NEW_PRICE_CAT"
-        elif tag == "td":
-            pass
-
-    def parse_price(self, price: str) -> int:
-        return int("".join(digit for digit in price if digit.isdigit()))
+        handler = self.tag_handlers.get(tag)
+        if handler is not None:
+            handler()
 
     def handle_data(self, data):
-        if self.mode == "IGNORE" or not data.strip():
-            return
-        if self.mode in ["INIT", "INFO"]:
-            print(data)
+        handler = self.data_handlers.get(self.mode)
+        if handler is None:
             return
         data = data.strip()
-        if self.mode == "NEW_CAT":
-            self.curr_category = Category(data)
-            if self.verbose:
-                print(f"Creating new category {data}")
-        elif self.mode == "NEW_MEAL":
-            self.curr_meal = Meal(data)
-            if self.verbose:
-                print(f"\tCreating new meal {data}")
-        elif self.mode == "NEW_INFOS":
-            if data == content_strings["NEW_INFOS_ALLERGENS"][self.lang]:
-                self.mode = "NEW_ALLERGENS"
-            elif data == content_strings["NEW_INFOS_ADDITIVES"][self.lang]:
-                self.mode = "NEW_ADDITIVES"
-            elif data in co2_strings:
-                self.curr_meal.co2_tag = co2_strings[data]
-                self.mode = "IGNORE"
-            else:
-                raise NotImplementedError(f"Mode NEW_INFOS with data {data}")
-        elif self.mode == "NEW_ALLERGENS":
+        if data:
+            handler(data)
+
+    def handle_category(self, data: str) -> None:
+        self.curr_category = Category(data)
+        if self.verbose:
+            print(f"Creating new category {data}", file=sys.stderr)
+
+    def handle_meal(self, data: str) -> None:
+        self.curr_meal = Meal(data)
+        if self.verbose:
+            print(f"\tCreating new meal {data}", file=sys.stderr)
+
+    def handle_infos(self, data: str) -> None:
+        mode = self.info_modes.get(data)
+        if mode is not None and self.curr_meal:
+            self.mode = mode
+            return
+        if data in co2_strings and self.curr_meal:
+            self.curr_meal.co2_tag = co2_strings[data]
+        elif self.verbose:
+            print(f"\t\tSkipping unknown info block: {data}", file=sys.stderr)
+        self.mode = ParserMode.IGNORE
+
+    def handle_allergen(self, data: str) -> None:
+        if self.verbose:
+            print(f"\t\tAdding new allergen: {data}", file=sys.stderr)
+        self.curr_meal.add_allergen(data)
+
+    def handle_additive(self, data: str) -> None:
+        if self.verbose:
+            print(f"\t\tAdding new additive: {data}", file=sys.stderr)
+        self.curr_meal.add_additive(data)
+
+    def handle_price_category(self, data: str) -> None:
+        mode = self.price_modes.get(data)
+        if mode is None or not self.curr_meal:
             if self.verbose:
-                print(f"\t\tAdding new allergen: {data}")
-            self.curr_meal.add_allergen(data)
-        elif self.mode == "NEW_ADDITIVES":
+                print(f"\t\tSkipping unknown price category: {data}", file=sys.stderr)
+            mode = ParserMode.IGNORE
+        self.mode = mode
+
+    def handle_price(self, data: str) -> None:
+        if self.last_nonignored_tag != "td":
+            return
+        try:
+            price = parse_price(data)
+        except ValueError:
             if self.verbose:
-                print(f"\t\tAdding new additive: {data}")
-            self.curr_meal.add_additive(data)
-        elif self.mode == "NEW_PRICE_CAT":
-            if data == content_strings["PRICE_CATEGORY_STUDENT"][self.lang]:
-                self.mode = "NEW_PRICE_STUDENT"
-            elif data == content_strings["PRICE_CATEGORY_STAFF"][self.lang]:
-                self.mode = "NEW_PRICE_STAFF"
-            elif data == content_strings["PRICE_CATEGORY_GUEST"][self.lang]:
-                self.mode = "NEW_PRICE_GUEST"
-            else:
-                raise NotImplementedError(f"Mode NEW_PRICE_CAT with data {data}")
-        elif self.mode == "NEW_PRICE_STUDENT":
-            assert self.last_nonignored_tag == "td"
-            self.curr_meal.student_price = self.parse_price(data)
-        elif self.mode == "NEW_PRICE_STAFF":
-            assert self.last_nonignored_tag == "td"
-            self.curr_meal.staff_price = self.parse_price(data)
-        elif self.mode == "NEW_PRICE_GUEST":
-            assert self.last_nonignored_tag == "td"
-            self.curr_meal.guest_price = self.parse_price(data)
+                print(f"\t\tSkipping unparsable price: {data}", file=sys.stderr)
+            return
+        if self.mode is ParserMode.NEW_PRICE_STUDENT:
+            self.curr_meal.student_price = price
+        elif self.mode is ParserMode.NEW_PRICE_STAFF:
+            self.curr_meal.staff_price = price
         else:
-            raise NotImplementedError(f"{self.last_nonignored_tag} with data {data}")
+            self.curr_meal.guest_price = price
 
     def to_xml(self, wCanteen) -> ET.Element:
-        if ET is None:
-            raise ImportError("XML functionality requires xml.etree.ElementTree")
-        
-        # Define namespaces
-        ns = {
-            "": "http://openmensa.org/open-mensa-v2",
-            "xsi": "http://www.w3.org/2001/XMLSchema-instance",
-        }
-        # Register namespaces
-        for prefix, uri in ns.items():
-            ET.register_namespace(prefix, uri)
+        return categories_to_xml(self.categories, wCanteen)
 
-        # Create the root element with namespaces
-        root = ET.Element(
-            "openmensa",
-            {
-                "version": "2.1",
-                "xmlns": ns[""],
-                "xmlns:xsi": ns["xsi"],
-                "xsi:schemaLocation": "http://openmensa.org/open-mensa-v2 http://openmensa.org/open-mensa-v2.xsd",
-            },
-        )
-        # Add version element
-        version = ET.SubElement(root, "version")
-        version.text = "5.04-4"
+    def close(self):
+        super().close()
+        self.start_new_category()
 
-        # Create the canteen and Date element
-        canteen = ET.SubElement(root, "canteen")
-        day = ET.SubElement(canteen, "day")
-        day.set("date", str(datetime.date.today()))
 
-        # Create the meals element
+def categories_to_xml(
+    categories: List[Category], wCanteen, date: Optional[str] = None
+) -> ET.Element:
+    if ET is None:
+        raise ImportError("XML functionality requires xml.etree.ElementTree")
+    
+    # Define namespaces
+    ns = {
+        "": "http://openmensa.org/open-mensa-v2",
+        "xsi": "http://www.w3.org/2001/XMLSchema-instance",
+    }
+    # Register namespaces
+    for prefix, uri in ns.items():
+        ET.register_namespace(prefix, uri)
+
+    # Create the root element with namespaces
+    root = ET.Element(
+        "openmensa",
+        {
+            "version": "2.1",
+            "xmlns": ns[""],
+            "xmlns:xsi": ns["xsi"],
+            "xsi:schemaLocation": "http://openmensa.org/open-mensa-v2 http://openmensa.org/open-mensa-v2.xsd",
+        },
+    )
+    # Add version element
+    version = ET.SubElement(root, "version")
+    version.text = "5.04-4"
+
+    # Create the canteen and Date element
+    canteen = ET.SubElement(root, "canteen")
+    day = ET.SubElement(canteen, "day")
+    day.set("date", date or str(datetime.date.today()))
+
+    # Create the meals element
+
+    for cat in categories:
+        category = ET.SubElement(day, "category")
+        category.set("name", cat.title)
+        for meal in cat.meals:
+            meal_element = ET.SubElement(category, "meal")
+            name = ET.SubElement(meal_element, "name")
+            name.text = meal.title
+            # Add allergens and Additives
+            allergens = ET.SubElement(meal_element, "note")
+            combined_list = meal.allergens + meal.additives
+            allergens.text = ", ".join(combined_list)
+            # Add prices
+            price = ET.SubElement(meal_element, "price")
+            price.set("role", "student")
+            price.text = str(f"{meal.student_price / 100:.2f}")
+            price = ET.SubElement(meal_element, "price")
+            price.set("role", "employee")
+            price.text = str(f"{meal.staff_price / 100:.2f}")
+            price = ET.SubElement(meal_element, "price")
+            price.set("role", "other")
+            price.text = str(f"{meal.guest_price / 100:.2f}")
+
+    return root
+
+
+# One session for all requests, so the connection to the Studierendenwerk
+# is kept alive between lookups
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+
+class UpstreamUnavailable(Exception):
+    """Raised without a request while the circuit breaker of an upstream is open."""
+
+
+class EmptyMenu(Exception):
+    """Raised when the upstream returns no meals for a menu that had some before."""
+
+
+class CircuitBreaker:
+    """Counts consecutive failed lookups of one upstream.
+
+    Once `failure_threshold` is reached the breaker opens and allow() returns
+    False for `reset_timeout` seconds. After that a single trial lookup is let
+    through; it closes the breaker again if it succeeds.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout: float = CIRCUIT_RESET_TIMEOUT,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.trial_running or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.trial_running = True
+            return True
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+circuit_breakers: Dict[str, CircuitBreaker] = {}
+circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(url: str) -> CircuitBreaker:
+    with circuit_breakers_lock:
+        if url not in circuit_breakers:
+            circuit_breakers[url] = CircuitBreaker()
+        return circuit_breakers[url]
+
+
+def post_with_retries(url: str, data: dict, verbose: bool = False) -> requests.Response:
+    """POST with jittered exponential backoff, guarded by the circuit breaker of `url`.
+
+    Connection errors, timeouts and 5xx responses are retried; the whole call
+    gives up after FETCH_DEADLINE seconds.
+    """
+    breaker = get_circuit_breaker(url)
+    if not breaker.allow():
+        raise UpstreamUnavailable(f"{url} failed repeatedly, not retrying for now")
+
+    deadline = time.monotonic() + FETCH_DEADLINE
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        try:
+            r = session.post(url, data=data, timeout=min(REQUEST_TIMEOUT, remaining))
+            if r.status_code < 500:
+                breaker.record_success()
+                return r
+            error: Exception = requests.HTTPError(f"{r.status_code} from {url}", response=r)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+        except requests.RequestException:
+            breaker.record_failure()
+            raise
+
+        backoff = random.uniform(0, FETCH_BACKOFF * 2 ** attempt)
+        attempt += 1
+        if attempt > FETCH_RETRIES or time.monotonic() + backoff >= deadline:
+            breaker.record_failure()
+            raise error
+        if verbose:
+            print(f"Request to {url} failed ({error}), retrying in {backoff:.2f}s", file=sys.stderr)
+        time.sleep(backoff)
+
+
+def fetch_menu(
+    date: str, canteen: str, language: str, url: str = MENSA_URL, verbose: bool = False
+) -> Tuple[List[Category], List[str]]:
+    """Return the categories of the menu and its notices, like changed opening hours."""
+    r = post_with_retries(
+        url,
+        {
+            "tx_festwb_mealsajax[date]": date,
+            "tx_festwb_mealsajax[canteen]": canteen_id_dict[canteen],
+            "tx_festwb_mealsajax[language]": language_id_dict[language],
+        },
+        verbose=verbose,
+    )
+    parser = SimpleMensaResponseParser(lang=language, verbose=verbose)
+    parser.feed(r.text)
+    parser.close()
+    return parser.categories, parser.infos
+
+
+class MenuArchive:
+    """SQLite archive of every parsed menu, keyed by canteen, date and language.
+
+    Past menus never change, so they are served from here without touching
+    the network. The trigram index in meal_titles backs the substring search
+    of last_served(), the index on category price_history().
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS menus (
+            canteen TEXT NOT NULL,
+            date TEXT NOT NULL,
+            lang TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            infos TEXT NOT NULL DEFAULT '[]',
+            PRIMARY KEY (canteen, date, lang)
+        );
+        CREATE TABLE IF NOT EXISTS meals (
+            id INTEGER PRIMARY KEY,
+            canteen TEXT NOT NULL,
+            date TEXT NOT NULL,
+            lang TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            title TEXT NOT NULL,
+            student_price INTEGER,
+            staff_price INTEGER,
+            guest_price INTEGER,
+            co2_tag TEXT,
+            allergens TEXT NOT NULL,
+            additives TEXT NOT NULL,
+            flags INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS meals_by_menu ON meals (canteen, date, lang, position);
+        CREATE INDEX IF NOT EXISTS meals_by_category ON meals (category, date);
+        CREATE VIRTUAL TABLE IF NOT EXISTS meal_titles USING fts5(
+            title, content='meals', content_rowid='id', tokenize='trigram'
+        );
+        CREATE TRIGGER IF NOT EXISTS meals_title_insert AFTER INSERT ON meals BEGIN
+            INSERT INTO meal_titles (rowid, title) VALUES (new.id, new.title);
+        END;
+        CREATE TRIGGER IF NOT EXISTS meals_title_delete AFTER DELETE ON meals BEGIN
+            INSERT INTO meal_titles (meal_titles, rowid, title) VALUES ('delete', old.id, old.title);
+        END;
+    """
+    MEAL_COLUMNS = (
+        "canteen, date, lang, position, category, title, student_price, staff_price,"
+        " guest_price, co2_tag, allergens, additives, flags"
+    )
 
-        for cat in self.categories:
-            categories = ET.SubElement(day, "category")
-            categories.set("name", cat.title)
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.initialized = False
+        self.lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        # one short-lived connection per call, so the archive can be used
+        # from the batch and server threads
+        with self.lock:
+            if not self.initialized:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with sqlite3.connect(self.path, timeout=10) as conn:
+                    conn.executescript(self.SCHEMA)
+                self.initialized = True
+        return sqlite3.connect(self.path, timeout=10)
+
+    def store(
+        self,
+        date: str,
+        canteen: str,
+        language: str,
+        categories: List[Category],
+        infos: List[str],
+    ) -> None:
+        rows = []
+        for cat in categories:
             for meal in cat.meals:
-                meal_element = ET.SubElement(categories, "meal")
-                name = ET.SubElement(meal_element, "name")
-                name.text = meal.title
-                # Add allergens and Additives
-                allergens = ET.SubElement(meal_element, "note")
-                combined_list = meal.allergens + meal.additives
-                allergens.text = ", ".join(combined_list)
-                # Add prices
-                price = ET.SubElement(meal_element, "price")
-                price.set("role", "student")
-                price.text = str(f"{meal.student_price / 100:.2f}")
-                price = ET.SubElement(meal_element, "price")
-                price.set("role", "employee")
-                price.text = str(f"{meal.staff_price / 100:.2f}")
-                price = ET.SubElement(meal_element, "price")
-                price.set("role", "other")
-                price.text = str(f"{meal.guest_price / 100:.2f}")
-
-        return root
+                rows.append((
+                    canteen,
+                    date,
+                    language,
+                    len(rows),
+                    cat.title,
+                    meal.title,
+                    meal.student_price,
+                    meal.staff_price,
+                    meal.guest_price,
+                    meal.co2_tag,
+                    json.dumps(meal.allergens, ensure_ascii=False),
+                    json.dumps(meal.additives, ensure_ascii=False),
+                    meal.flags,
+                ))
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute(
+                    "DELETE FROM meals WHERE canteen = ? AND date = ? AND lang = ?",
+                    (canteen, date, language),
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO menus (canteen, date, lang, fetched_at, infos)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (canteen, date, language, time.time(), json.dumps(infos, ensure_ascii=False)),
+                )
+                conn.executemany(
+                    f"INSERT INTO meals ({self.MEAL_COLUMNS})"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+        finally:
+            conn.close()
+
+    def load(
+        self, date: str, canteen: str, language: str
+    ) -> Optional[Tuple[float, List[Category], List[str]]]:
+        """Return (fetched_at, categories, infos) or None if the menu was never stored."""
+        conn = self.connect()
+        try:
+            menu_row = conn.execute(
+                "SELECT fetched_at, infos FROM menus WHERE canteen = ? AND date = ? AND lang = ?",
+                (canteen, date, language),
+            ).fetchone()
+            if menu_row is None:
+                return None
+            meal_rows = conn.execute(
+                "SELECT category, title, student_price, staff_price, guest_price, co2_tag,"
+                " allergens, additives, flags FROM meals"
+                " WHERE canteen = ? AND date = ? AND lang = ? ORDER BY position",
+                (canteen, date, language),
+            ).fetchall()
+        finally:
+            conn.close()
+
+        categories: List[Category] = []
+        for row in meal_rows:
+            if not categories or categories[-1].title != row[0]:
+                categories.append(Category(row[0]))
+            meal = Meal(row[1])
+            meal.student_price, meal.staff_price, meal.guest_price = row[2], row[3], row[4]
+            meal.co2_tag = row[5]
+            meal.allergens = json.loads(row[6])
+            meal.additives = json.loads(row[7])
+            meal.flags = row[8]
+            categories[-1].add_meal(meal)
+        return menu_row[0], categories, json.loads(menu_row[1])
+
+    def last_served(
+        self, title: str, canteens: Optional[List[str]] = None, limit: int = 10
+    ) -> List[dict]:
+        """Most recent days on which a meal whose title contains `title` was served.
+
+        The trigram index answers the substring match for `title` of three
+        or more characters; shorter ones scan all titles.
+        """
+        query = (
+            "SELECT MAX(meals.date) AS last_date, meals.canteen, meals.lang, meals.category,"
+            " meals.title, meals.student_price"
+            " FROM meal_titles JOIN meals ON meals.id = meal_titles.rowid"
+            " WHERE meal_titles.title LIKE ?"
+        )
+        params: list = [f"%{title}%"]
+        if canteens:
+            query += f" AND meals.canteen IN ({', '.join('?' * len(canteens))})"
+            params += canteens
+        query += " GROUP BY meals.canteen, meals.lang, meals.title ORDER BY last_date DESC LIMIT ?"
+        params.append(limit)
+        conn = self.connect()
+        try:
+            rows = conn.execute(query, params).fetchall()
+        finally:
+            conn.close()
+        keys = ("date", "canteen", "lang", "category", "title", "student_price")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def price_history(
+        self, category: str, canteens: Optional[List[str]] = None
+    ) -> List[dict]:
+        """Average and range of the prices in a category, per canteen and day."""
+        query = (
+            "SELECT date, canteen, COUNT(*), AVG(student_price), MIN(student_price),"
+            " MAX(student_price), AVG(staff_price), AVG(guest_price)"
+            " FROM meals WHERE category = ?"
+        )
+        params: list = [category]
+        if canteens:
+            query += f" AND canteen IN ({', '.join('?' * len(canteens))})"
+            params += canteens
+        query += " GROUP BY date, canteen ORDER BY date, canteen"
+        conn = self.connect()
+        try:
+            rows = conn.execute(query, params).fetchall()
+        finally:
+            conn.close()
+        keys = (
+            "date",
+            "canteen",
+            "meals",
+            "avg_student_price",
+            "min_student_price",
+            "max_student_price",
+            "avg_staff_price",
+            "avg_guest_price",
+        )
+        return [dict(zip(keys, row)) for row in rows]
+
+
+class MenuCache:
+    """Parsed menus keyed on (url, date, canteen, language), with stale-while-revalidate.
+
+    Every menu is cached as (categories, infos), as returned by fetch_menu().
+
+    Menus of the real Studierendenwerk URL are also written to `archive`;
+    past menus and menus archived less than `ttl` seconds ago are read back
+    from it instead of being fetched again. Concurrent misses for the same
+    key wait for a single fetch.
+    """
+
+    def __init__(
+        self,
+        ttl: float = MENU_CACHE_TTL,
+        stale_ttl: float = MENU_CACHE_STALE_TTL,
+        archive: Optional[MenuArchive] = None,
+    ):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.archive = archive
+        self.entries: Dict[
+            Tuple[str, str, str, str], Tuple[float, Tuple[List[Category], List[str]]]
+        ] = {}
+        self.refreshing: Set[Tuple[str, str, str, str]] = set()
+        self.loading: Dict[Tuple[str, str, str, str], Future] = {}
+        self.lock = threading.Lock()
+
+    def get(
+        self, date: str, canteen: str, language: str, url: str = MENSA_URL, verbose: bool = False
+    ) -> Tuple[List[Category], List[str]]:
+        key = (url, date, canteen, language)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry:
+            fetched_at, menu = entry
+            age = time.monotonic() - fetched_at
+            if age < self.ttl:
+                return menu
+            if age < self.ttl + self.stale_ttl:
+                self.refresh_in_background(key, verbose)
+                return menu
+        return self.refresh(key, verbose, fallback=True)
+
+    def prefetch(
+        self,
+        date: str,
+        canteen: str,
+        language: str,
+        max_age: float,
+        url: str = MENSA_URL,
+        verbose: bool = False,
+    ) -> bool:
+        """Fetch the menu unless a copy younger than `max_age` is cached; returns True if fetched."""
+        key = (url, date, canteen, language)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry and time.monotonic() - entry[0] < max_age:
+            return False
+        self.refresh(key, verbose, max_age=max_age)
+        return True
+
+    def refresh(
+        self,
+        key: Tuple[str, str, str, str],
+        verbose: bool = False,
+        max_age: Optional[float] = None,
+        fallback: bool = False,
+    ) -> Tuple[List[Category], List[str]]:
+        """Load the menu from the archive or the upstream.
+
+        Only one load per key runs at a time; callers that miss while it
+        runs get its result. With `fallback`, a failed fetch returns the
+        last menu that was ever fetched for the key, however old, and only
+        raises if there is none.
+        """
+        with self.lock:
+            pending = self.loading.get(key)
+            owner = pending is None
+            if owner:
+                pending = self.loading[key] = Future()
+
+        try:
+            if owner:
+                try:
+                    menu = self.load(key, verbose, max_age)
+                    pending.set_result(menu)
+                    return menu
+                except Exception as e:
+                    pending.set_exception(e)
+                    raise
+                finally:
+                    with self.lock:
+                        del self.loading[key]
+            return pending.result()
+        except Exception as e:
+            archive = self.archive if key[0] == MENSA_URL else None
+            last_known = self.last_known(key, archive, verbose) if fallback else None
+            if last_known is None:
+                raise
+            if verbose:
+                print(f"Fetching {key} failed ({e}), serving the last known menu", file=sys.stderr)
+            return last_known
+
+    def load(
+        self,
+        key: Tuple[str, str, str, str],
+        verbose: bool = False,
+        max_age: Optional[float] = None,
+    ) -> Tuple[List[Category], List[str]]:
+        url, date, canteen, language = key
+        archive = self.archive if url == MENSA_URL else None
+
+        if archive is not None:
+            archived = self.load_archived(archive, key, max_age or self.ttl, verbose)
+            if archived is not None:
+                return archived
+
+        menu = fetch_menu(date, canteen, language, url=url, verbose=verbose)
+        if not menu[0]:
+            # a maintenance page or an empty body parses to no categories;
+            # it must not replace a real menu in the cache or the archive
+            previous = self.last_known(key, archive, verbose)
+            if previous is not None and previous[0]:
+                raise EmptyMenu(f"{url} returned no meals for {date} {canteen} [{language}]")
+        with self.lock:
+            self.entries[key] = (time.monotonic(), menu)
+        if archive is not None:
+            try:
+                archive.store(date, canteen, language, *menu)
+            except (sqlite3.Error, OSError) as e:
+                if verbose:
+                    print(f"Could not archive menu {key}: {e}", file=sys.stderr)
+        return menu
+
+    def load_archived(
+        self,
+        archive: MenuArchive,
+        key: Tuple[str, str, str, str],
+        max_age: float,
+        verbose: bool = False,
+    ) -> Optional[Tuple[List[Category], List[str]]]:
+        url, date, canteen, language = key
+        try:
+            archived = archive.load(date, canteen, language)
+        except (sqlite3.Error, OSError) as e:
+            if verbose:
+                print(f"Could not read menu archive: {e}", file=sys.stderr)
+            return None
+        if archived is None:
+            return None
+
+        fetched_at, categories, infos = archived
+        age = time.time() - fetched_at
+        is_past = date < datetime.date.today().strftime("%Y-%m-%d")
+        if not is_past and age >= max_age:
+            return None
+        menu = (categories, infos)
+        with self.lock:
+            self.entries[key] = (time.monotonic() - (0 if is_past else age), menu)
+        return menu
+
+    def last_known(
+        self,
+        key: Tuple[str, str, str, str],
+        archive: Optional[MenuArchive],
+        verbose: bool = False,
+    ) -> Optional[Tuple[List[Category], List[str]]]:
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry:
+            return entry[1]
+        if archive is None:
+            return None
+        url, date, canteen, language = key
+        try:
+            archived = archive.load(date, canteen, language)
+        except (sqlite3.Error, OSError) as e:
+            if verbose:
+                print(f"Could not read menu archive: {e}", file=sys.stderr)
+            return None
+        return (archived[1], archived[2]) if archived else None
+
+    def refresh_in_background(self, key: Tuple[str, str, str, str], verbose: bool = False) -> None:
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+
+        def run():
+            try:
+                self.refresh(key, verbose)
+            except Exception as e:
+                if verbose:
+                    print(f"Background refresh of {key} failed: {e}", file=sys.stderr)
+            finally:
+                with self.lock:
+                    self.refreshing.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+menu_cache = MenuCache(archive=MenuArchive(MENSA_ARCHIVE_PATH) if MENSA_ARCHIVE_PATH else None)
+
+
+def warm_menus(
+    canteens: List[str],
+    dates: List[str],
+    languages: List[str],
+    verbose: bool = False,
+    max_workers: int = BATCH_WORKERS,
+    max_age: Optional[float] = None,
+) -> int:
+    """Load every combination into the cache and archive; returns how many failed.
+
+    With `max_age`, menus cached for longer than that are fetched again even
+    if they are still fresh enough to be served.
+    """
+    jobs = [
+        (date, canteen, language)
+        for date in dates
+        for canteen in canteens
+        for language in languages
+    ]
 
-    def close(self):
-        super().close()
-        self.start_new_category()
+    def fetch(job) -> bool:
+        date, canteen, language = job
+        try:
+            if max_age is None:
+                menu_cache.get(date, canteen, language, verbose=verbose)
+            else:
+                menu_cache.prefetch(date, canteen, language, max_age, verbose=verbose)
+            return True
+        except Exception as e:
+            print(f"Fetching {canteen} {date} [{language}] failed: {e}", file=sys.stderr)
+            return False
 
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return sum(not ok for ok in pool.map(fetch, jobs))
 
-def get_mensa_data() -> datetime.date:
-    print("Fetching mensa data...")
+
+def next_working_days(
+    count: int, start: Optional[datetime.date] = None
+) -> List[datetime.date]:
     # Since the canteenes ar elocated in NRW get the public holidays for NRW
     try:
         nrw_holidays = holidays.country_holidays("DE", subdiv="NW")
@@ -399,15 +1132,463 @@ def get_mensa_data() -> datetime.date:
         # Fallback if holidays module not working
         nrw_holidays = {}
 
-    date = datetime.date.today()
-    # Initialize the next working day as the day after today
-    next_working_day = date + datetime.timedelta()
+    day = start or datetime.date.today()
+    working_days = []
+    # Skip every day that is a weekend or a public holiday
+    while len(working_days) < count:
+        if day.weekday() < 5 and day not in nrw_holidays:
+            working_days.append(day)
+        day += datetime.timedelta(days=1)
+    return working_days
 
-    # Loop until we find a day that is not a weekend or a public holiday
-    while next_working_day.weekday() >= 5 or next_working_day in nrw_holidays:
-        next_working_day += datetime.timedelta(days=1)
 
-    return next_working_day
+def get_mensa_data() -> datetime.date:
+    """The next working day, the day shown when no date is given."""
+    return next_working_days(1)[0]
+
+
+def prefetch_upcoming(
+    canteens: Optional[List[str]] = None,
+    languages: Optional[List[str]] = None,
+    days: int = PREFETCH_DAYS,
+    interval: float = PREFETCH_INTERVAL,
+    verbose: bool = False,
+) -> int:
+    """Refresh the menus of the next working days; returns how many failed.
+
+    Menus that would expire from the cache before the next run, `interval`
+    seconds from now, are fetched again so users never hit a cold cache.
+    """
+    dates = [day.strftime("%Y-%m-%d") for day in next_working_days(days)]
+    failed = warm_menus(
+        canteens=canteens or list(canteen_id_dict),
+        dates=dates,
+        languages=languages or ["de", "en"],
+        verbose=verbose,
+        max_age=max(menu_cache.ttl - interval, 0),
+    )
+    if verbose:
+        print(f"Prefetched menus for {', '.join(dates)}, {failed} failed", file=sys.stderr)
+    return failed
+
+
+class Prefetcher(threading.Thread):
+    """Daemon thread that runs prefetch_upcoming every `interval` seconds until stopped."""
+
+    def __init__(
+        self,
+        interval: float = PREFETCH_INTERVAL,
+        canteens: Optional[List[str]] = None,
+        languages: Optional[List[str]] = None,
+        days: int = PREFETCH_DAYS,
+        verbose: bool = False,
+    ) -> None:
+        super().__init__(name="mensa-prefetcher", daemon=True)
+        self.interval = interval
+        self.canteens = canteens
+        self.languages = languages
+        self.days = days
+        self.verbose = verbose
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                prefetch_upcoming(
+                    self.canteens, self.languages, self.days, self.interval, self.verbose
+                )
+            except Exception as e:
+                print(f"Prefetching failed: {e}", file=sys.stderr)
+            self.stopped.wait(self.interval)
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+
+def get_remove_flags(filter_mode: Optional[str], gluten_free: bool) -> int:
+    # meals with any of these flags are filtered out
+    if filter_mode == "vegetarian":
+        remove_flags = FLAG_MEAT
+    elif filter_mode == "vegan":
+        remove_flags = FLAG_MEAT | FLAG_OVO_LACTO
+    else:
+        remove_flags = 0  # Changed to not raise error for unknown filter modes
+
+    if gluten_free:
+        remove_flags |= FLAG_GLUTEN
+    return remove_flags
+
+
+class Menu:
+    """The menu of one canteen on one day, with the requested filters applied.
+
+    `found` is False when the Studierendenwerk returned no categories at all,
+    e.g. because the canteen is closed; `categories` only contains categories
+    with at least one meal left after filtering. `infos` are the notices
+    above the menu, like changed opening hours. `title_width` is the length
+    of the longest category title before meals were filtered out, which the
+    text output pads the category column to.
+    """
+
+    def __init__(
+        self,
+        date: str,
+        canteen: str,
+        language: str,
+        categories: List[Category],
+        found: bool,
+        infos: Optional[List[str]] = None,
+        title_width: Optional[int] = None,
+    ) -> None:
+        self.date = date
+        self.canteen = canteen
+        self.language = language
+        self.categories = categories
+        self.found = found
+        self.infos = infos or []
+        if title_width is None:
+            title_width = max((len(cat.title) for cat in categories), default=0)
+        self.title_width = title_width
+
+
+def get_menu(
+    date: Optional[str],
+    canteen: str,
+    language: str,
+    filtered_categories: Optional[List[str]] = None,
+    filter_mode: Optional[str] = None,
+    gluten_free: bool = False,
+    url: str = MENSA_URL,
+    verbose: bool = False,
+) -> Menu:
+    """Fetch (or look up) a menu and apply the filters, without any output.
+
+    Errors while fetching are raised to the caller.
+    """
+    if date is None:
+        date = get_mensa_data().strftime("%Y-%m-%d")
+    filtered_categories = filtered_categories or []
+
+    all_categories, infos = menu_cache.get(date, canteen, language, url=url, verbose=verbose)
+    remove_flags = get_remove_flags(filter_mode, gluten_free)
+
+    categories = []
+    title_width = 0
+    for cat in all_categories:
+        if cat.title in filtered_categories:
+            continue
+        title_width = max(title_width, len(cat.title))
+        filtered_meals = [meal for meal in cat.meals if not meal.flags & remove_flags]
+        if not filtered_meals:
+            continue
+        # the cached categories are shared, so filtering builds new ones
+        filtered_cat = Category(cat.title)
+        filtered_cat.meals = filtered_meals
+        categories.append(filtered_cat)
+
+    return Menu(
+        date,
+        canteen,
+        language,
+        categories,
+        found=bool(all_categories),
+        infos=infos,
+        title_width=title_width,
+    )
+
+
+def get_colors(colors: bool) -> Dict:
+    if colors:
+        return {
+            "QUERY": Fore.MAGENTA,
+            "CATEGORY": Fore.GREEN,
+            "MEAL": Fore.BLUE,
+            "PRICE": Fore.CYAN,
+            "ALLERGEN": Fore.RED,
+            "ADDITIVE": Fore.YELLOW,
+            "WARN": Fore.RED,
+            "RESET": Style.RESET_ALL,
+            "CO2": {
+                "CO2_TAG_GREEN": Fore.GREEN,
+                "CO2_TAG_ORANGE": Fore.YELLOW,
+                "CO2_TAG_RED": Fore.RED,
+            },
+        }
+    return {
+        "QUERY": "",
+        "CATEGORY": "",
+        "MEAL": "",
+        "PRICE": "",
+        "ALLERGEN": "",
+        "ADDITIVE": "",
+        "WARN": "",
+        "RESET": "",
+        "CO2": {
+            "CO2_TAG_GREEN": "",
+            "CO2_TAG_ORANGE": "",
+            "CO2_TAG_RED": "",
+        },
+    }
+
+
+def interesting_allergens_for(language: str) -> Set[str]:
+    return (
+        meat_allergens[language]
+        | ovo_lacto_allergens[language]
+        | other_allergens[language]
+    )
+
+
+def render_json(menu: Menu) -> dict:
+    json_categories = []
+    for cat in menu.categories:
+        json_meals = []
+        for meal in cat.meals:
+            co2_info = None
+            if meal.co2_tag:
+                co2_info = output_strs[meal.co2_tag][menu.language]
+
+            # Determine vegetarian/vegan status
+            isVegan = not meal.flags & (FLAG_MEAT | FLAG_OVO_LACTO)
+            isVegetarian = not meal.flags & FLAG_MEAT
+
+            json_meals.append({
+                "name": meal.title,
+                "prices": {
+                    "student": meal.student_price / 100,
+                    "staff": meal.staff_price / 100,
+                    "guest": meal.guest_price / 100
+                },
+                "allergens": meal.allergens,
+                "additives": meal.additives,
+                "co2": co2_info,
+                "isVegetarian": isVegetarian,
+                "isVegan": isVegan
+            })
+
+        json_categories.append({
+            "category": cat.title,
+            "meals": json_meals
+        })
+
+    # Create the complete JSON response
+    return {
+        "date": menu.date,
+        "canteen": menu.canteen,
+        "lang": menu.language,
+        "infos": menu.infos,
+        "categories": json_categories
+    }
+
+
+def render_markdown(
+    menu: Menu,
+    show_all_allergens: bool = False,
+    show_additives: bool = False,
+    show_co2: bool = False,
+    price: str = "Student",
+    show_all_prices: bool = False,
+) -> str:
+    language = menu.language
+    interesting_allergens = interesting_allergens_for(language)
+    out = []
+
+    out.append(f"| {output_strs['MD_TABLE_COL_CAT'][language]}")
+    out.append(f"| {output_strs['MD_TABLE_COL_MEAL'][language]}")
+    out.append(f"| {output_strs['MD_TABLE_COL_PRICE'][language]}")
+    if show_all_allergens:
+        out.append(f"| {output_strs['MD_TABLE_COL_ALLERGENS'][language]}")
+    else:
+        out.append(f"| {output_strs['MD_TABLE_COL_SOME_ALLERGENS'][language]}")
+    if show_additives:
+        out.append(f"| {output_strs['MD_TABLE_COL_ADDITIVES'][language]}")
+    if show_co2:
+        out.append(f"| {output_strs['MD_TABLE_COL_CO2'][language]}")
+    out.append(" |\n")
+    out.append(f"| :-- | :-- | --: | :-- | ")
+    if show_additives:
+        out.append(":-- |")
+    if show_co2:
+        out.append(":-- |")
+    out.append("\n")
+
+    for cat in menu.categories:
+        for meal_idx, meal in enumerate(cat.meals):
+            if meal_idx:
+                out.append(f"| |")
+            else:
+                out.append(f"| {cat.title} |")
+
+            # Show meal title and price(s)
+            out.append(f" {meal.title} | ")
+
+            # Display all prices or just the selected price
+            if show_all_prices:
+                out.append(f"S:{meal.student_price/100:.2f}€/E:{meal.staff_price/100:.2f}€/G:{meal.guest_price/100:.2f}€ |")
+            else:
+                if price == "Student":
+                    out.append(f"{meal.student_price/100:.2f}€ |")
+                elif price == "Staff":
+                    out.append(f"{meal.staff_price/100:.2f}€ |")
+                elif price == "Guest":
+                    out.append(f"{meal.guest_price/100:.2f}€ |")
+
+            if show_all_allergens:
+                allergen_str = ", ".join(meal.allergens)
+            else:
+                allergen_str = ", ".join(
+                    al for al in meal.allergens if al in interesting_allergens
+                )
+            out.append(f" {allergen_str} |")
+
+            if show_additives:
+                additives_str = ", ".join(meal.additives)
+                out.append(f" {additives_str} |")
+
+            if show_co2:
+                co2_str = output_strs[meal.co2_tag][language] if meal.co2_tag else ''
+                out.append(f" {co2_str} |")
+
+            out.append("\n")
+    return "".join(out)
+
+
+def render_text(
+    menu: Menu,
+    colors: bool = True,
+    show_all_allergens: bool = False,
+    show_additives: bool = False,
+    show_co2: bool = False,
+    price: str = "Student",
+    show_all_prices: bool = False,
+) -> str:
+    language = menu.language
+    interesting_allergens = interesting_allergens_for(language)
+    c = get_colors(colors)
+    out = []
+    if not menu.categories:
+        return ""
+
+    maxlen_catname = menu.title_width
+    for cat in menu.categories:
+        cat_str = cat.title.ljust(maxlen_catname + 1)
+        out.append(f"{c['CATEGORY']}{cat_str}{c['RESET']}")
+
+        for meal_idx, meal in enumerate(cat.meals):
+            # do not indent first line
+            if meal_idx:
+                out.append(" " * (maxlen_catname + 1))
+
+            # Display meal title
+            out.append(f"{c['MEAL']}{meal.title} ")
+
+            # Display all prices or just the selected price
+            if show_all_prices:
+                out.append(f"{c['PRICE']}(S:{meal.student_price/100:.2f}€/E:{meal.staff_price/100:.2f}€/G:{meal.guest_price/100:.2f}€)")
+            else:
+                if price == "Student":
+                    out.append(f"{c['PRICE']}({meal.student_price/100:.2f}€)")
+                elif price == "Staff":
+                    out.append(f"{c['PRICE']}({meal.staff_price/100:.2f}€)")
+                elif price == "Guest":
+                    out.append(f"{c['PRICE']}({meal.guest_price/100:.2f}€)")
+
+            if meal.allergens and (
+                show_all_allergens or set(meal.allergens) & interesting_allergens
+            ):
+                if show_all_allergens:
+                    allergen_str = ", ".join(meal.allergens)
+                else:
+                    allergen_str = ", ".join(
+                        al for al in meal.allergens if al in interesting_allergens
+                    )
+                out.append(f" {c['ALLERGEN']}[{allergen_str}]")
+
+            if show_additives and meal.additives:
+                additives_str = ", ".join(meal.additives)
+                out.append(f" {c['ADDITIVE']}[{additives_str}]")
+
+            if show_co2 and meal.co2_tag:
+                co2_str = output_strs[meal.co2_tag][language]
+                color = c["CO2"][meal.co2_tag]
+                out.append(f" {color}[CO₂: {co2_str}]")
+
+            out.append(f"{c['RESET']}\n")
+    return "".join(out)
+
+
+def render_xml(menu: Menu) -> ET.Element:
+    return categories_to_xml(menu.categories, menu.canteen, menu.date)
+
+
+def get_menu_json(
+    date: Optional[str],
+    canteen: str,
+    filtered_categories: List[str],
+    language: str,
+    filter_mode: Optional[str] = None,
+    gluten_free: bool = False,
+    url: str = MENSA_URL,
+    verbose: bool = False,
+) -> dict:
+    """Return the menu in the format of the --json output."""
+    if date is None:
+        date = get_mensa_data().strftime("%Y-%m-%d")
+
+    try:
+        menu = get_menu(
+            date,
+            canteen,
+            language,
+            filtered_categories=filtered_categories,
+            filter_mode=filter_mode,
+            gluten_free=gluten_free,
+            url=url,
+            verbose=verbose,
+        )
+    except Exception:
+        # Return JSON error response with fallback mock data
+        return get_mock_menu_data(date, canteen, language)
+    if not menu.found:
+        return get_mock_menu_data(date, canteen, language)
+    return render_json(menu)
+
+
+def get_menus_json(
+    canteens: List[str],
+    dates: List[str],
+    languages: List[str],
+    filtered_categories: List[str],
+    filter_mode: Optional[str] = None,
+    gluten_free: bool = False,
+    url: str = MENSA_URL,
+    verbose: bool = False,
+    max_workers: int = BATCH_WORKERS,
+) -> dict:
+    """Fetch every canteen x date x language combination concurrently."""
+    jobs = [
+        (date, canteen, language)
+        for date in dates
+        for canteen in canteens
+        for language in languages
+    ]
+
+    def fetch(job):
+        date, canteen, language = job
+        return get_menu_json(
+            date,
+            canteen,
+            filtered_categories,
+            language,
+            filter_mode=filter_mode,
+            gluten_free=gluten_free,
+            url=url,
+            verbose=verbose,
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        menus = list(pool.map(fetch, jobs))
+    return {"menus": menus}
 
 
 def query_mensa(
@@ -420,7 +1601,7 @@ def query_mensa(
     show_additives: bool = False,
     show_co2: bool = False,
     gluten_free: bool = False,
-    url: str = "https://www.studierendenwerk-bonn.de/?type=1732731666",
+    url: str = MENSA_URL,
     verbose: bool = False,
     price: str = "Student",
     colors: bool = True,
@@ -429,46 +1610,21 @@ def query_mensa(
     show_all_prices: bool = False,
     json_output: bool = False,  # New parameter for JSON output
 ) -> None:
+    """Print the menu; in-process callers should use get_menu() instead."""
     if date is None:
         # If no date is provided get next valid day i.E. working days from monday to fridy
         # this does not take into account closures due to operational reasons
+        print("Fetching mensa data...")
         date = get_mensa_data().strftime("%Y-%m-%d")
 
-    if colors:
-        QUERY_COLOR = Fore.MAGENTA
-        CATEGORY_COLOR = Fore.GREEN
-        MEAL_COLOR = Fore.BLUE
-        PRICE_COLOR = Fore.CYAN
-        ALLERGEN_COLOR = Fore.RED
-        ADDITIVE_COLOR = Fore.YELLOW
-        WARN_COLOR = Fore.RED
-        RESET_COLOR = Style.RESET_ALL
-        CO2_COLORS = {
-            "CO2_TAG_GREEN": Fore.GREEN,
-            "CO2_TAG_ORANGE": Fore.YELLOW,
-            "CO2_TAG_RED": Fore.RED,
-        }
-    else:
-        QUERY_COLOR = ""
-        CATEGORY_COLOR = ""
-        MEAL_COLOR = ""
-        PRICE_COLOR = ""
-        ALLERGEN_COLOR = ""
-        ADDITIVE_COLOR = ""
-        WARN_COLOR = ""
-        RESET_COLOR = ""
-        CO2_COLORS = {
-            "CO2_TAG_GREEN": "",
-            "CO2_TAG_ORANGE": "",
-            "CO2_TAG_RED": "",
-        }
+    c = get_colors(colors)
 
     filter_str = f" [{filter_mode}]" if filter_mode else ""
     if markdown_output:
         print(f"### Mensa {canteen} – {date}{filter_str} [{language}]\n")
     else:
         print(
-            f"{QUERY_COLOR}Mensa {canteen} – {date}{filter_str} [{language}]{RESET_COLOR}"
+            f"{c['QUERY']}Mensa {canteen} – {date}{filter_str} [{language}]{c['RESET']}"
         )
 
     if verbose:
@@ -476,253 +1632,70 @@ def query_mensa(
             f"Querying for date={date}, canteen={canteen}, filtered_categories={filtered_categories}, filter_mode={filter_mode}, url={url}"
         )
     
+
+    # Handle JSON output if requested
+    if json_output:
+        json_data = get_menu_json(
+            date,
+            canteen,
+            filtered_categories,
+            language,
+            filter_mode=filter_mode,
+            gluten_free=gluten_free,
+            url=url,
+            verbose=verbose,
+        )
+        print(json.dumps(json_data, ensure_ascii=False, indent=2))
+        return
+
     try:
-        r = requests.post(
-            url,
-            data={
-                "tx_festwb_mealsajax[date]": date,
-                "tx_festwb_mealsajax[canteen]": canteen_id_dict[canteen],
-                "tx_festwb_mealsajax[language]": language_id_dict[language],
-            },
-            timeout=10  # Add timeout to prevent hanging
+        menu = get_menu(
+            date,
+            canteen,
+            language,
+            filtered_categories=filtered_categories,
+            filter_mode=filter_mode,
+            gluten_free=gluten_free,
+            url=url,
+            verbose=verbose,
         )
-        parser = SimpleMensaResponseParser(lang=language, verbose=verbose)
-        parser.feed(r.text)
-        parser.close()
     except Exception as e:
         error_msg = f"Error fetching mensa data: {str(e)}"
-        if json_output:
-            # Return JSON error response with fallback mock data
-            json_data = get_mock_menu_data(date, canteen, language)
-            print(json.dumps(json_data, ensure_ascii=False, indent=2))
-            return
-        else:
-            print(f"{WARN_COLOR}{error_msg}{RESET_COLOR}")
-            return
-
-    if not parser.categories:
-        error_msg = f"Query failed. Please check https://www.studierendenwerk-bonn.de if the mensa is open today."
-        if json_output:
-            # Return JSON error response with fallback mock data
-            json_data = get_mock_menu_data(date, canteen, language)
-            print(json.dumps(json_data, ensure_ascii=False, indent=2))
-            return
-        else:
-            print(f"{WARN_COLOR}{error_msg}{RESET_COLOR}")
-            return
-    print()
-
-    queried_categories = [
-        cat for cat in parser.categories if cat.title not in filtered_categories
-    ]
-    if not queried_categories:
-        if json_output:
-            # Return empty JSON response
-            json_data = {
-                "date": date,
-                "canteen": canteen,
-                "lang": language,
-                "categories": []
-            }
-            print(json.dumps(json_data, ensure_ascii=False, indent=2))
+        print(f"{c['WARN']}{error_msg}{c['RESET']}")
         return
 
-    interesting_allergens = (
-        meat_allergens[language]
-        | ovo_lacto_allergens[language]
-        | other_allergens[language]
-    )
+    # notices like changed opening hours, also when the canteen is closed
+    for info in menu.infos:
+        print(info)
 
-    if filter_mode is None:
-        remove_allergens = set()
-    elif filter_mode == "vegetarian":
-        remove_allergens = meat_allergens[language]
-    elif filter_mode == "vegan":
-        remove_allergens = meat_allergens[language] | ovo_lacto_allergens[language]
-    else:
-        remove_allergens = set()  # Changed to not raise error for unknown filter modes
-
-    if gluten_free:
-        remove_allergens.update(gluten_allergens[language])
-
-    # Handle JSON output if requested
-    if json_output:
-        json_categories = []
-        
-        for cat in queried_categories:
-            filtered_meals = [
-                meal for meal in cat.meals if not set(meal.allergens) & remove_allergens
-            ]
-
-            if not filtered_meals:
-                continue
-                
-            json_meals = []
-            for meal in filtered_meals:
-                allergens_list = meal.allergens
-                additives_list = meal.additives
-                
-                co2_info = None
-                if meal.co2_tag:
-                    co2_info = output_strs[meal.co2_tag][language]
-                
-                # Determine vegetarian/vegan status
-                hasMeat = any(a in meat_allergens[language] for a in meal.allergens)
-                hasDairy = any(a in ovo_lacto_allergens[language] for a in meal.allergens)
-                isVegan = not (hasMeat or hasDairy)
-                isVegetarian = not hasMeat
-                
-                json_meals.append({
-                    "name": meal.title,
-                    "prices": {
-                        "student": meal.student_price / 100,
-                        "staff": meal.staff_price / 100,
-                        "guest": meal.guest_price / 100
-                    },
-                    "allergens": allergens_list,
-                    "additives": additives_list,
-                    "co2": co2_info,
-                    "isVegetarian": isVegetarian,
-                    "isVegan": isVegan
-                })
-            
-            if json_meals:
-                json_categories.append({
-                    "category": cat.title,
-                    "meals": json_meals
-                })
-        
-        # Create the complete JSON response
-        json_data = {
-            "date": date,
-            "canteen": canteen,
-            "lang": language,
-            "categories": json_categories
-        }
-        
-        # Print the JSON response
-        print(json.dumps(json_data, ensure_ascii=False, indent=2))
+    if not menu.found:
+        error_msg = f"Query failed. Please check https://www.studierendenwerk-bonn.de if the mensa is open today."
+        print(f"{c['WARN']}{error_msg}{c['RESET']}")
         return
+    print()
 
-    maxlen_catname = max(len(cat.title) for cat in queried_categories)
+    render_options = dict(
+        show_all_allergens=show_all_allergens,
+        show_additives=show_additives,
+        show_co2=show_co2,
+        price=price,
+        show_all_prices=show_all_prices,
+    )
     if markdown_output:
-        print(f"| {output_strs['MD_TABLE_COL_CAT'][language]}", end="")
-        print(f"| {output_strs['MD_TABLE_COL_MEAL'][language]}", end="")
-        print(f"| {output_strs['MD_TABLE_COL_PRICE'][language]}", end="")
-        if show_all_allergens:
-            print(f"| {output_strs['MD_TABLE_COL_ALLERGENS'][language]}", end="")
-        else:
-            print(f"| {output_strs['MD_TABLE_COL_SOME_ALLERGENS'][language]}", end="")
-        if show_additives:
-            print(f"| {output_strs['MD_TABLE_COL_ADDITIVES'][language]}", end="")
-        if show_co2:
-            print(f"| {output_strs['MD_TABLE_COL_CO2'][language]}", end="")
-        print(" |")
-        print(f"| :-- | :-- | --: | :-- | ", end="")
-        if show_additives:
-            print(":-- |", end="")
-        if show_co2:
-            print(":-- |", end="")
-        print()
-
-    for cat in queried_categories:
-        filtered_meals = [
-            meal for meal in cat.meals if not set(meal.allergens) & remove_allergens
-        ]
-
-        if not filtered_meals:
-            continue
-
-        if markdown_output:
-            for meal_idx, meal in enumerate(filtered_meals):
-                if meal_idx:
-                    print(f"| |", end="")
-                else:
-                    print(f"| {cat.title} |", end="")
-                
-                # Show meal title and price(s)
-                print(f" {meal.title} | ", end="")
-                
-                # Display all prices or just the selected price
-                if show_all_prices:
-                    print(f"S:{meal.student_price/100:.2f}€/E:{meal.staff_price/100:.2f}€/G:{meal.guest_price/100:.2f}€ |", end="")
-                else:
-                    if price == "Student":
-                        print(f"{meal.student_price/100:.2f}€ |", end="")
-                    elif price == "Staff":
-                        print(f"{meal.staff_price/100:.2f}€ |", end="")
-                    elif price == "Guest":
-                        print(f"{meal.guest_price/100:.2f}€ |", end="")
-
-                if show_all_allergens:
-                    allergen_str = ", ".join(meal.allergens)
-                else:
-                    allergen_str = ", ".join(
-                        al for al in meal.allergens if al in interesting_allergens
-                    )
-                print(f" {allergen_str} |", end="")
-
-                if show_additives:
-                    additives_str = ", ".join(meal.additives)
-                    print(f" {additives_str} |", end="")
-
-                if show_co2:
-                    co2_str = output_strs[meal.co2_tag][language] if meal.co2_tag else ''
-                    print(f" {co2_str} |", end="")
-
-                print("")
-        else:
-            cat_str = cat.title.ljust(maxlen_catname + 1)
-            print(f"{CATEGORY_COLOR}{cat_str}{RESET_COLOR}", end="")
-
-            for meal_idx, meal in enumerate(filtered_meals):
-                # do not indent first line
-                if meal_idx:
-                    print(" " * (maxlen_catname + 1), end="")
-                
-                # Display meal title
-                print(f"{MEAL_COLOR}{meal.title} ", end="")
-                
-                # Display all prices or just the selected price
-                if show_all_prices:
-                    print(f"{PRICE_COLOR}(S:{meal.student_price/100:.2f}€/E:{meal.staff_price/100:.2f}€/G:{meal.guest_price/100:.2f}€)", end="")
-                else:
-                    if price == "Student":
-                        print(f"{PRICE_COLOR}({meal.student_price/100:.2f}€)", end="")
-                    elif price == "Staff":
-                        print(f"{PRICE_COLOR}({meal.staff_price/100:.2f}€)", end="")
-                    elif price == "Guest":
-                        print(f"{PRICE_COLOR}({meal.guest_price/100:.2f}€)", end="")
-                
-                if meal.allergens and (
-                    show_all_allergens or set(meal.allergens) & interesting_allergens
-                ):
-                    if show_all_allergens:
-                        allergen_str = ", ".join(meal.allergens)
-                    else:
-                        allergen_str = ", ".join(
-                            al for al in meal.allergens if al in interesting_allergens
-                        )
-                    print(f" {ALLERGEN_COLOR}[{allergen_str}]", end="")
-
-                if show_additives and meal.additives:
-                    additives_str = ", ".join(meal.additives)
-                    print(f" {ADDITIVE_COLOR}[{additives_str}]", end="")
-
-                if show_co2 and meal.co2_tag:
-                    co2_str = output_strs[meal.co2_tag][language]
-                    color = CO2_COLORS[meal.co2_tag]
-                    print(f" {color}[CO₂: {co2_str}]", end="")
-
-                print(f"{RESET_COLOR}")
-        if xml_output:
-            xml_root = parser.to_xml(canteen)
-            xml_tree = ET.ElementTree(xml_root)
-            filename = f"{canteen}_{date}_{time.time()}.xml"
-            xml_tree.write(
-                filename, encoding="utf-8", xml_declaration=True, method="xml"
-            )
-            print(f"XML saved to {filename}")
+        print(render_markdown(menu, **render_options), end="")
+    else:
+        print(render_text(menu, colors=colors, **render_options), end="")
+
+    if xml_output:
+        # the XML export always contains every meal with all allergens;
+        # the unfiltered menu comes from the same cached fetch
+        full_menu = get_menu(date, canteen, language, url=url, verbose=verbose)
+        xml_tree = ET.ElementTree(render_xml(full_menu))
+        filename = f"{canteen}_{date}_{time.time()}.xml"
+        xml_tree.write(
+            filename, encoding="utf-8", xml_declaration=True, method="xml"
+        )
+        print(f"XML saved to {filename}")
 
 # Fallback mock menu data for times when the actual site is unreachable
 def get_mock_menu_data(date, mensa="SanktAugustin", lang="en"):
@@ -747,6 +1720,7 @@ def get_mock_menu_data(date, mensa="SanktAugustin", lang="en"):
             "canteen": mensa,
             "lang": lang,
             "error": f"The mensa is closed on weekends.",
+            "infos": [],
             "categories": []
         }
     
@@ -756,6 +1730,7 @@ def get_mock_menu_data(date, mensa="SanktAugustin", lang="en"):
         "canteen": mensa,
         "lang": lang,
         "error": "Could not connect to the real mensa service. Showing mock data.",
+        "infos": [],
         "categories": [
             {
                 "category": "Main Dishes",
@@ -931,9 +1906,148 @@ def get_parser():
         help="Show all price categories (Student, Staff, Guest)",
     )
 
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Fetch several canteens, dates and languages at once and print one JSON document.",
+    )
+    parser.add_argument(
+        "--canteens",
+        nargs="+",
+        choices=canteen_id_dict.keys(),
+        default=None,
+        help="Canteens to fetch in batch mode. Defaults to all canteens.",
+    )
+    parser.add_argument(
+        "--dates",
+        nargs="+",
+        default=None,
+        help="Dates (YYYY-MM-DD) to fetch in batch mode. Defaults to --date, or else the next --days working days.",
+    )
+    parser.add_argument(
+        "--days",
+        type=int,
+        default=5,
+        help="Number of upcoming working days to fetch in batch mode if no --dates are given. Defaults to 5.",
+    )
+    parser.add_argument(
+        "--langs",
+        nargs="+",
+        choices=["de", "en"],
+        default=None,
+        help="Languages to fetch in batch mode. Defaults to --lang.",
+    )
+
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Run an HTTP server that answers GET /api/mensa with the --json output.",
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Address the server listens on. Defaults to 127.0.0.1.",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8001,
+        help="Port the server listens on. Defaults to 8001.",
+    )
+
+    parser.add_argument(
+        "--archive",
+        type=str,
+        default=None,
+        help="SQLite file in which all fetched menus are archived. Defaults to $MENSA_ARCHIVE "
+        "or ~/.cache/bonn-mensa/menus.sqlite3.",
+    )
+    parser.add_argument(
+        "--backfill",
+        nargs=2,
+        metavar=("START", "END"),
+        default=None,
+        help="Fetch every working day from START to END (YYYY-MM-DD) into the archive.",
+    )
+    parser.add_argument(
+        "--last-served",
+        type=str,
+        metavar="DISH",
+        default=None,
+        help="Show when a dish containing DISH was last served, according to the archive.",
+    )
+    parser.add_argument(
+        "--price-history",
+        type=str,
+        metavar="CATEGORY",
+        default=None,
+        help="Show the archived student prices of a category per day.",
+    )
+
+    parser.add_argument(
+        "--prefetch",
+        action="store_true",
+        help="Keep refreshing the menus of the upcoming working days for all canteens "
+        "(or --canteens) and languages (or --langs), so they are always cached.",
+    )
+    parser.add_argument(
+        "--prefetch-interval",
+        type=float,
+        default=PREFETCH_INTERVAL,
+        help=f"Seconds between two prefetch runs. Defaults to {PREFETCH_INTERVAL}. "
+        "With --prefetch, 0 runs once and exits; with --serve, 0 disables prefetching.",
+    )
+    parser.add_argument(
+        "--prefetch-days",
+        type=int,
+        default=PREFETCH_DAYS,
+        help=f"Number of upcoming working days to prefetch. Defaults to {PREFETCH_DAYS}.",
+    )
+
     return parser
 
 
+def run_archive_cmd(args) -> None:
+    archive = menu_cache.archive
+    if archive is None:
+        print("The menu archive is disabled.", file=sys.stderr)
+        sys.exit(1)
+
+    if args.backfill:
+        start, end = (
+            datetime.datetime.strptime(day, "%Y-%m-%d").date() for day in args.backfill
+        )
+        days = [day.strftime("%Y-%m-%d") for day in next_working_days((end - start).days + 1, start)]
+        days = [day for day in days if day <= end.strftime("%Y-%m-%d")]
+        failed = warm_menus(
+            canteens=args.canteens or list(canteen_id_dict),
+            dates=days,
+            languages=args.langs or [args.lang],
+            verbose=args.verbose,
+        )
+        print(f"Archived {len(days)} days, {failed} menus failed.", file=sys.stderr)
+        return
+
+    if args.last_served:
+        rows = archive.last_served(args.last_served, canteens=args.canteens)
+    else:
+        rows = archive.price_history(args.price_history, canteens=args.canteens)
+
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return
+    for row in rows:
+        if args.last_served:
+            print(f"{row['date']}  {row['canteen']} [{row['lang']}]  {row['category']}: {row['title']}")
+        else:
+            low, high = row["min_student_price"] or 0, row["max_student_price"] or 0
+            print(
+                f"{row['date']}  {row['canteen']}  {row['meals']} meals, "
+                f"{low/100:.2f}€ - {high/100:.2f}€"
+            )
+
+
 def run_cmd(args):
     if args.vegan:
         filter_mode: Optional[str] = "vegan"
@@ -942,6 +2056,25 @@ def run_cmd(args):
     else:
         filter_mode = None
 
+    if args.batch:
+        if args.dates:
+            dates = args.dates
+        elif args.date:
+            dates = [args.date]
+        else:
+            dates = [day.strftime("%Y-%m-%d") for day in next_working_days(args.days)]
+        json_data = get_menus_json(
+            canteens=args.canteens or list(canteen_id_dict),
+            dates=dates,
+            languages=args.langs or [args.lang],
+            filtered_categories=args.filter_categories,
+            filter_mode=filter_mode,
+            gluten_free=args.glutenfree,
+            verbose=args.verbose,
+        )
+        print(json.dumps(json_data, ensure_ascii=False, indent=2))
+        return
+
     query_mensa(
         date=args.date,
         canteen=args.mensa,
@@ -962,6 +2095,141 @@ def run_cmd(args):
     )
 
 
+class MensaRequestHandler(BaseHTTPRequestHandler):
+    """Serves GET /api/mensa with the same query parameters as the Next.js route.
+
+    GET /api/mensa/batch takes repeated mensa, date and lang parameters (or
+    days=N for the next N working days) and returns all menus at once.
+    The process stays alive between requests, so the menu cache and the
+    connection to the Studierendenwerk are reused.
+    """
+
+    verbose = False
+
+    def do_GET(self):
+        request_url = urllib.parse.urlsplit(self.path)
+        params = urllib.parse.parse_qs(request_url.query, keep_blank_values=True)
+        path = request_url.path.rstrip("/")
+        try:
+            if path == "/api/mensa":
+                self.handle_menu(params)
+            elif path == "/api/mensa/batch":
+                self.handle_batch(params)
+            else:
+                self.send_json({"error": "Not found"}, status=404)
+        except Exception as e:
+            self.send_json({"error": f"Internal server error: {e}"}, status=500)
+
+    def filter_options(self, params) -> dict:
+        if "vegan" in params:
+            filter_mode: Optional[str] = "vegan"
+        elif "vegetarian" in params:
+            filter_mode = "vegetarian"
+        else:
+            filter_mode = None
+        return {
+            "filtered_categories": params.get("filterCategories", ["Buffet", "Dessert"]),
+            "filter_mode": filter_mode,
+            "gluten_free": "glutenfree" in params,
+            "verbose": self.verbose,
+        }
+
+    def handle_menu(self, params) -> None:
+        canteen = params.get("mensa", ["SanktAugustin"])[0]
+        language = params.get("lang", ["en"])[0]
+        if canteen not in canteen_id_dict:
+            self.send_json({"error": f"Unknown mensa {canteen}"}, status=400)
+            return
+        if language not in language_id_dict:
+            self.send_json({"error": f"Unknown language {language}"}, status=400)
+            return
+
+        json_data = get_menu_json(
+            date=params.get("date", [None])[0] or None,
+            canteen=canteen,
+            language=language,
+            **self.filter_options(params),
+        )
+        self.send_json(json_data)
+
+    def handle_batch(self, params) -> None:
+        canteens = params.get("mensa", list(canteen_id_dict))
+        languages = params.get("lang", ["en"])
+        unknown = [c for c in canteens if c not in canteen_id_dict] + [
+            l for l in languages if l not in language_id_dict
+        ]
+        if unknown:
+            self.send_json({"error": f"Unknown mensa or language: {', '.join(unknown)}"}, status=400)
+            return
+        dates = params.get("date")
+        if dates:
+            try:
+                for date in dates:
+                    datetime.datetime.strptime(date, "%Y-%m-%d")
+            except ValueError:
+                self.send_json({"error": f"Invalid date {date}, expected YYYY-MM-DD"}, status=400)
+                return
+        else:
+            days = params.get("days", ["5"])[0]
+            if not days.isdigit() or not 1 <= int(days) <= BATCH_MAX_DAYS:
+                self.send_json(
+                    {"error": f"days must be a number from 1 to {BATCH_MAX_DAYS}"}, status=400
+                )
+                return
+            dates = [day.strftime("%Y-%m-%d") for day in next_working_days(int(days))]
+        menus = len(dates) * len(canteens) * len(languages)
+        if len(dates) > BATCH_MAX_DAYS or menus > BATCH_MAX_MENUS:
+            self.send_json(
+                {
+                    "error": f"At most {BATCH_MAX_DAYS} days and {BATCH_MAX_MENUS} menus per request,"
+                    f" {len(dates)} days and {menus} menus requested"
+                },
+                status=400,
+            )
+            return
+
+        json_data = get_menus_json(
+            canteens=canteens,
+            dates=dates,
+            languages=languages,
+            **self.filter_options(params),
+        )
+        self.send_json(json_data)
+
+    def send_json(self, data, status: int = 200) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+def serve(
+    host: str,
+    port: int,
+    verbose: bool = False,
+    prefetcher: Optional[Prefetcher] = None,
+) -> None:
+    MensaRequestHandler.verbose = verbose
+    server = ThreadingHTTPServer((host, port), MensaRequestHandler)
+    print(f"Serving mensa data on http://{host}:{port}/api/mensa and /api/mensa/batch")
+    if prefetcher is not None:
+        prefetcher.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if prefetcher is not None:
+            prefetcher.stop()
+        server.server_close()
+
+
 def main():
     try:
         colorama_init()
@@ -969,6 +2237,35 @@ def main():
         pass
         
     args = get_parser().parse_args()
+    if args.archive is not None:
+        menu_cache.archive = MenuArchive(args.archive) if args.archive else None
+    if args.backfill or args.last_served or args.price_history:
+        run_archive_cmd(args)
+        return
+    if args.prefetch:
+        if args.prefetch_interval <= 0:
+            failed = prefetch_upcoming(
+                args.canteens, args.langs, args.prefetch_days, verbose=args.verbose
+            )
+            sys.exit(1 if failed else 0)
+        prefetcher = Prefetcher(
+            args.prefetch_interval, args.canteens, args.langs, args.prefetch_days, args.verbose
+        )
+        prefetcher.start()
+        try:
+            while prefetcher.is_alive():
+                prefetcher.join(1)
+        except KeyboardInterrupt:
+            prefetcher.stop()
+        return
+    if args.serve:
+        prefetcher = None
+        if args.prefetch_interval > 0:
+            prefetcher = Prefetcher(
+                args.prefetch_interval, args.canteens, args.langs, args.prefetch_days, args.verbose
+            )
+        serve(args.host, args.port, verbose=args.verbose, prefetcher=prefetcher)
+        return
     run_cmd(args)
 
 
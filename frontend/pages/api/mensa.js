@@ -5,6 +5,10 @@ import fs from 'fs';
 
 const execAsync = promisify(exec);
 
+// The mensa server answers from its cache; if it hangs, the request falls back
+// to the Python script instead of waiting forever
+const MENSA_SERVER_TIMEOUT = 10000;
+
 export default async function handler(req, res) {
   if (req.method !== 'GET') {
     return res.status(405).json({ error: 'Method not allowed' });
@@ -26,7 +30,38 @@ export default async function handler(req, res) {
     const showAllPrices = 'showAllPrices' in req.query;
     const vegan = 'vegan' in req.query;
     const vegetarian = 'vegetarian' in req.query;
-    
+
+    // Prefer the long-running mensa server (python mensa.py --serve) if one is
+    // configured; it keeps its caches warm instead of starting Python per request
+    if (process.env.MENSA_SERVER_URL) {
+      try {
+        const serverUrl = new URL('/api/mensa', process.env.MENSA_SERVER_URL);
+        serverUrl.searchParams.set('mensa', mensa);
+        serverUrl.searchParams.set('lang', lang);
+        serverUrl.searchParams.set('date', date);
+        filterCategories.forEach(category => serverUrl.searchParams.append('filterCategories', category));
+        if (vegan) serverUrl.searchParams.set('vegan', '');
+        if (vegetarian) serverUrl.searchParams.set('vegetarian', '');
+
+        const response = await fetch(serverUrl.toString(), {
+          signal: AbortSignal.timeout(MENSA_SERVER_TIMEOUT)
+        });
+        if (response.ok) {
+          const jsonData = await response.json();
+          return res.json({
+            data: jsonData,
+            params: {
+              mensa, lang, date, filterCategories,
+              showAllAllergens, showAdditives, showAllPrices, vegan, vegetarian
+            }
+          });
+        }
+        console.warn(`Mensa server returned ${response.status}, falling back to the Python script`);
+      } catch (error) {
+        console.warn('Mensa server not reachable, falling back to the Python script:', error.message);
+      }
+    }
+
     // Try multiple potential locations for the Python script
     const possibleScriptPaths = [
       path.join(process.cwd(), 'api', 'mensa.py'),